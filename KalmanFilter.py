@@ -36,8 +36,11 @@ http://web.mit.edu/kirtley/kirtley/binlustuff/literature/control/Kalman%20filter
 """
 
 from __future__ import print_function, division
+import math
 import numpy as np
-from numpy.linalg import inv
+from numpy.linalg import inv, cholesky
+from ParallelKalmanFilter import parallelFilter
+from KalmanFilterBank import packCovariance, unpackCovariance
 
 class KalmanFilter(object):
 	"""
@@ -78,26 +81,56 @@ class KalmanFilter(object):
 	P: 2D np_array, prior error covariance matrix
 	cur_x: 1D np_array, current estimate of the state
 	cur_P: 2D np_array, current estimate error covaiance matrix
+	logLikelihood: float, innovation log-likelihood of the measurements
+	               in the last update() or filter() call
+	metrics: Metrics collecting the stage times of update(), see metrics.py,
+	         None (the default) disables the instrumentation
+
+	dtype: None keeps the arrays as they are given, np.float32 selects the
+	       reduced-precision mode. Its rounding errors make the covariance
+	       drift away from symmetric, so then cur_P is symmetrized after 
+	       every update.
 	"""
 
-	def __init__(self, A, B, H, Q, R, cur_x, cur_P):
+	metrics = None
+
+	def __init__(self, A, B, H, Q, R, cur_x, cur_P, dtype=None):
+
+		def copy(M):
+			return M.copy() if dtype is None else np.array(M, dtype=dtype)
 		
-		self.A = A.copy()
-		self.B = B.copy()
-		self.H = H.copy()
-		self.Q = Q.copy()
-		self.R = R.copy()
+		self.A = copy(A)
+		self.B = copy(B)
+		self.H = copy(H)
+		self.Q = copy(Q)
+		self.R = copy(R)
 
 		self.last_x = None
 		self.last_P = None
 
 		self.x = None
 		self.P = None
-		self.cur_x = cur_x.copy()
-		self.cur_P = cur_P.copy()
+		self.cur_x = copy(cur_x)
+		self.cur_P = copy(cur_P)
+		self.logLikelihood = 0.0
+
+		self.dtype = dtype
+		self.symmetrize = dtype is not None and np.dtype(dtype) != np.float64
+
 
+	def update(self, measureState, control, likelihood=False):
+		"""
+		likelihood: also evaluate logLikelihood, which the per-frame
+		            updates of the GUI have no use for
+		"""
 
-	def update(self, measureState, control):
+		metrics = self.metrics
+		if metrics is not None:
+			t = metrics.start()
+
+		if self.dtype is not None:
+			measureState = np.asarray(measureState, dtype=self.dtype)
+			control = np.asarray(control, dtype=self.dtype)
 
 		self.measureState = measureState
 		self.control = control
@@ -109,14 +142,94 @@ class KalmanFilter(object):
 		self.x = np.dot(self.A, self.cur_x) + np.dot(self.B, self.control)
 		self.P = np.matmul(self.A, np.matmul(self.cur_P, self.A.T)) + self.Q
 
+		if metrics is not None:
+			t = metrics.lap("predict", t)
+
 		# correction
 		self.S = np.matmul(self.H, np.matmul(self.P, self.H.T)) + self.R
-		self.K = np.matmul(self.P, np.matmul(self.H.T, inv(self.S))) 
+		if likelihood:
+			# one Cholesky factor S = L * L' gives both the gain and the
+			# log-likelihood, S^-1 = W' * W with W = L^-1
+			L = cholesky(self.S)
+			W = inv(L)
+			Sinv = np.dot(W.T, W)
+		else:
+			Sinv = inv(self.S)
+		self.K = np.matmul(self.P, np.matmul(self.H.T, Sinv)) 
+
+		if metrics is not None:
+			t = metrics.lap("gain", t)
+
 		self.y = self.measureState - np.dot(self.H, self.x)
 
+		if likelihood:
+			# log-likelihood of the innovation y ~ N(0, S)
+			w = np.dot(W, self.y)
+			self.logLikelihood = -0.5 * (float(np.dot(w, w))
+				+ 2 * float(np.log(L.diagonal()).sum())
+				+ len(self.y) * math.log(2 * math.pi))
+
 		self.cur_x = self.x + np.dot(self.K, self.y)
-		self.cur_P = np.matmul(np.eye(4) - np.matmul(self.K, self.H),
+		self.cur_P = np.matmul(np.eye(len(self.cur_x), dtype=self.P.dtype) - np.matmul(self.K, self.H),
 			self.P)
+		if self.symmetrize:
+			self.cur_P = 0.5 * (self.cur_P + self.cur_P.T)
+
+		if metrics is not None:
+			metrics.end("correct", t)
+			metrics.innovation(self.y, float(np.dot(self.y, np.dot(Sinv, self.y))))
+
+	def filter(self, measureStates, controls=None, parallel=False, processes=None,
+		packed=False):
+		"""
+		Run the filter over a whole sequence of measurements.
+
+		measureStates: 2D np_array, one measurement per row
+		controls: 2D np_array, one control per row, None means no control
+		parallel: evaluate the sequence with the parallel-in-time scan of
+		          ParallelKalmanFilter instead of calling update() row by row
+		processes: size of the process pool in the parallel mode
+		packed: return the covariance matrices as packed upper triangles,
+		        see KalmanFilterBank.packCovariance()
+
+		Return the current estimates of every step, a 2D np_array of states
+		and a 3D (2D if packed) np_array of error covariance matrices, both
+		of the filter's dtype. Afterwards cur_x, cur_P
+		and last_x, last_P hold the last two steps, as if update() had been 
+		called for every row, and logLikelihood is the total log-likelihood
+		of the sequence.
+		"""
+		n = len(self.cur_x)
+		dtype = float if self.dtype is None else self.dtype
+
+		if parallel:
+			means, covs, self.logLikelihood = parallelFilter(self.A, self.B, self.H,
+				self.Q, self.R, self.cur_x, self.cur_P, measureStates, controls,
+				processes, dtype=dtype, packed=packed, likelihood=True)
+			full = unpackCovariance(covs[-2:], n) if packed else covs
+			if len(means) > 1:
+				self.last_x, self.last_P = means[-2].copy(), full[-2].copy()
+			elif len(means) == 1:
+				self.last_x, self.last_P = self.cur_x.copy(), self.cur_P.copy()
+			if len(means) > 0:
+				self.cur_x, self.cur_P = means[-1].copy(), full[-1].copy()
+			return means, covs
+
+		means = np.empty((len(measureStates), n), dtype=dtype)
+		if packed:
+			covs = np.empty((len(measureStates), n * (n + 1) // 2), dtype=dtype)
+		else:
+			covs = np.empty((len(measureStates), n, n), dtype=dtype)
+		noControl = np.zeros(self.B.shape[1])
+		total = 0.0
+		for k in range(len(measureStates)):
+			self.update(measureStates[k], noControl if controls is None else controls[k],
+				likelihood=True)
+			means[k] = self.cur_x
+			covs[k] = packCovariance(self.cur_P) if packed else self.cur_P
+			total += self.logLikelihood
+		self.logLikelihood = total
+		return means, covs
 
 
 
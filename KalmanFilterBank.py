@@ -0,0 +1,222 @@
+"""
+A bank of Kalman filters tracking many objects at once.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+"""
+
+from __future__ import print_function, division
+import math
+import numpy as np
+
+
+def _transpose(M):
+	"""
+	transpose a stack of matrices
+	"""
+	return np.swapaxes(M, -1, -2)
+
+
+def _symmetrize(M):
+	"""
+	symmetric part of a stack of matrices
+	"""
+	return 0.5 * (M + _transpose(M))
+
+
+# per dimension n, the positions of the upper triangle in a flattened
+# n x n matrix, and the packed position of every entry of the matrix
+_packIndices = {}
+
+
+def _packing(n):
+
+	if n not in _packIndices:
+		rows, cols = np.triu_indices(n)
+		packed = np.empty((n, n), dtype=np.intp)
+		packed[rows, cols] = np.arange(len(rows))
+		packed[cols, rows] = np.arange(len(rows))
+		_packIndices[n] = (rows * n + cols, packed.ravel())
+	return _packIndices[n]
+
+
+def packCovariance(P):
+	"""
+	Pack a (stack of) symmetric n x n matrices into their upper triangles,
+	the rows of the triangle one after the other, n * (n + 1) / 2 values.
+	"""
+	n = P.shape[-1]
+	return np.take(P.reshape(P.shape[:-2] + (n * n,)), _packing(n)[0], axis=-1)
+
+
+def unpackCovariance(Pp, n):
+	"""
+	Unpack upper triangles made by packCovariance() into symmetric n x n matrices.
+	"""
+	return np.take(Pp, _packing(n)[1], axis=-1).reshape(Pp.shape[:-1] + (n, n))
+
+
+def choleskySolve(L, b):
+	"""
+	solve S * x = b for a stack of S = L * L' given by their Cholesky factors
+	"""
+	return np.linalg.solve(_transpose(L), np.linalg.solve(L, b))
+
+
+def choleskyLogLikelihood(L, y, W=None):
+	"""
+	log-likelihood of the innovations y under N(0, S), S = L * L',
+	for a stack of Cholesky factors L and innovations y (one per row).
+	W: the inverse factors L^-1, if they are known already
+	"""
+	m = y.shape[-1]
+	if W is None:
+		w = np.linalg.solve(L, y[..., None])[..., 0]
+	else:
+		w = np.einsum("kij,kj->ki", W, y)
+	logdet = 2 * np.sum(np.log(np.diagonal(L, axis1=-2, axis2=-1)), axis=-1)
+	return -0.5 * (np.sum(w * w, axis=-1) + logdet + m * math.log(2 * math.pi))
+
+
+class KalmanFilterBank(object):
+	"""
+	Kalman Filter Bank,
+	every track is an independent KalmanFilter, all of them share the model
+	matrices A, B, H, Q, R. The states of the tracks are stacked in arrays,
+	so that one update() advances the whole bank with vectorized NumPy calls.
+
+	A, B, H, Q, R: 2D np_array, as in KalmanFilter
+
+	last_x: 2D np_array, previous states, one track per row
+	last_P: 3D np_array, previous error covariance matrices
+	measureState: 2D np_array, measurements, one track per row
+	x: 2D np_array, prior estimates of the states
+	P: 3D np_array, prior error covariance matrices
+	cur_x: 2D np_array, current estimates of the states
+	cur_P: 3D np_array, current estimate error covariance matrices
+	logLikelihood: 1D np_array, innovation log-likelihood of each track
+	               in the last update() or filter() call
+
+	dtype: np.float64, or np.float32 for the reduced-precision mode, in
+	       which the covariances are symmetrized after every update
+	packed: store cur_P and last_P as packed upper triangles, 2D np_array
+	        (track, n * (n + 1) / 2), see packCovariance(). update() unpacks
+	        them only for the time of the computation.
+
+	Memory of the state of one track (x, P, last_x, last_P) for n = 4,
+	320 bytes in float64, 224 packed, 160 in float32 and 112 packed.
+	"""
+
+	def __init__(self, A, B, H, Q, R, cur_x, cur_P, dtype=np.float64, packed=False):
+
+		self.dtype = np.dtype(dtype)
+		self.packed = packed
+		self.symmetrize = self.dtype != np.float64
+
+		self.A = np.array(A, dtype=dtype)
+		self.B = np.array(B, dtype=dtype)
+		self.H = np.array(H, dtype=dtype)
+		self.Q = np.array(Q, dtype=dtype)
+		self.R = np.array(R, dtype=dtype)
+
+		self.last_x = None
+		self.last_P = None
+
+		self.x = None
+		self.P = None
+		self.cur_x = np.array(cur_x, dtype=dtype)
+		n = self.cur_x.shape[-1]
+		if packed:
+			if np.shape(cur_P)[-2:] == (n, n):
+				cur_P = packCovariance(np.asarray(cur_P))
+			self.cur_P = np.array(np.broadcast_to(cur_P, 
+				(len(self.cur_x), n * (n + 1) // 2)), dtype=dtype)
+		else:
+			self.cur_P = np.array(np.broadcast_to(cur_P, 
+				(len(self.cur_x), n, n)), dtype=dtype)
+		self.logLikelihood = np.zeros(len(self.cur_x))
+
+	@property
+	def ntracks(self):
+		return len(self.cur_x)
+
+	def covariances(self):
+		"""
+		current error covariance matrices, 3D np_array, unpacked if need be
+		"""
+		if self.packed:
+			return unpackCovariance(self.cur_P, self.cur_x.shape[1])
+		return self.cur_P
+
+	def update(self, measureStates, controls=None):
+		"""
+		measureStates: 2D np_array, one measurement per track
+		controls: 1D np_array shared by all tracks, or 2D np_array with
+		          one control per track, None means no control
+		"""
+
+		measureStates = np.asarray(measureStates, dtype=self.dtype)
+		if controls is not None:
+			controls = np.asarray(controls, dtype=self.dtype)
+
+		self.measureState = measureStates
+		self.control = controls
+
+		# memorize current states as previous states
+		self.last_x, self.last_P = self.cur_x.copy(), self.cur_P.copy()
+
+		# prior estimate of x, P
+		n = self.cur_x.shape[1]
+		cur_P = self.covariances()
+		self.x = np.dot(self.cur_x, self.A.T)
+		if controls is not None:
+			self.x += np.dot(controls, self.B.T)
+		self.P = np.matmul(np.matmul(self.A, cur_P), self.A.T) + self.Q
+
+		# correction, one Cholesky factor S = L * L' gives both the gain
+		# and the log-likelihood of the innovation. With W = L^-1, 
+		# S^-1 = W' * W, which takes one inversion per track instead of
+		# a solve for the gain and another one for the innovation.
+		self.S = np.matmul(np.matmul(self.H, self.P), self.H.T) + self.R
+		L = np.linalg.cholesky(self.S)
+		W = np.linalg.inv(L)
+		self.K = np.matmul(np.matmul(self.P, self.H.T), np.matmul(_transpose(W), W))
+		self.y = measureStates - np.dot(self.x, self.H.T)
+		self.logLikelihood = choleskyLogLikelihood(L, self.y, W)
+
+		self.cur_x = self.x + np.einsum("kij,kj->ki", self.K, self.y)
+		cur_P = np.matmul(np.eye(n, dtype=self.dtype) - np.matmul(self.K, self.H),
+			self.P)
+		if self.packed:
+			# unpacking mirrors the upper triangle, which symmetrizes as well
+			self.cur_P = packCovariance(cur_P)
+		elif self.symmetrize:
+			self.cur_P = _symmetrize(cur_P)
+		else:
+			self.cur_P = cur_P
+
+	def filter(self, measureStates, controls=None):
+		"""
+		Run the bank over whole sequences of measurements.
+
+		measureStates: 3D np_array, (track, step, measurement)
+		controls: 3D np_array, (track, step, control), None means no control
+
+		Return the current estimates of every track and step, a 3D np_array
+		of states and a 4D np_array of error covariance matrices (3D if the
+		bank is packed). Afterwards logLikelihood holds the total 
+		log-likelihood of each track.
+		"""
+		T = measureStates.shape[1]
+		n = self.cur_x.shape[1]
+		means = np.empty((self.ntracks, T, n), dtype=self.dtype)
+		covs = np.empty((self.ntracks, T) + self.cur_P.shape[1:], dtype=self.dtype)
+		total = np.zeros(self.ntracks)
+
+		for k in range(T):
+			self.update(measureStates[:, k], None if controls is None else controls[:, k])
+			means[:, k], covs[:, k] = self.cur_x, self.cur_P
+			total += self.logLikelihood
+
+		self.logLikelihood = total
+		return means, covs
@@ -0,0 +1,318 @@
+"""
+Log-likelihood and EM estimation of the model matrices A, Q, R
+from recorded measurements.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+The EM algorithm follows R. H. Shumway and D. S. Stoffer, "An approach to
+time series smoothing and forecasting using the EM algorithm",
+J. Time Series Analysis 3(4), 1982.
+
+All the trajectories start from the same prior (cur_x, cur_P), so their
+error covariances, gains and innovation covariances do not depend on the
+data and are identical. They are computed once per pass, and only the
+means are propagated, batched over the trajectories. Once the covariance
+has reached its steady state, the remaining steps reuse it and nothing
+is stored for them. From there on the filter and smoother recursions of
+the means have constant matrices, and they are solved for all the steps
+at once with a scan instead of a loop over the steps. A single recording
+of a day at 30 Hz (2.6M steps, n = 4) takes about 2 s per EM iteration,
+so long recordings need not be cut into segments.
+"""
+
+from __future__ import print_function, division
+import math
+import numpy as np
+from KalmanFilterBank import choleskySolve, _symmetrize, _transpose
+
+
+def _asTrajectories(measureStates, controls):
+	"""
+	bring the data to time-major arrays, (step, trajectory, ...)
+	"""
+	measureStates = np.asarray(measureStates, dtype=float)
+	if measureStates.ndim == 2:
+		measureStates = measureStates[None]
+		if controls is not None:
+			controls = np.asarray(controls, dtype=float)[None]
+	measureStates = np.ascontiguousarray(np.swapaxes(measureStates, 0, 1))
+	if controls is not None:
+		controls = np.ascontiguousarray(np.swapaxes(np.asarray(controls, dtype=float), 0, 1))
+	return measureStates, controls
+
+
+def _asGroups(measureStates, controls):
+	"""
+	_asTrajectories() of every group of trajectories of the same length,
+	a list of trajectories may have different lengths
+	"""
+	if not isinstance(measureStates, (list, tuple)):
+		return [_asTrajectories(measureStates, controls)]
+	groups = []
+	for T in sorted(set(len(z) for z in measureStates)):
+		index = [i for i, z in enumerate(measureStates) if len(z) == T]
+		groups.append(_asTrajectories([measureStates[i] for i in index],
+			None if controls is None else [controls[i] for i in index]))
+	return groups
+
+
+def _dot(x, M):
+	"""
+	M * x_k for every step and trajectory of x (step, trajectory, ...),
+	as a single product of 2D arrays, which is much faster than np.dot()
+	of a 3D array
+	"""
+	return np.matmul(x.reshape(-1, x.shape[-1]), M.T).reshape(x.shape[:-1] + (M.shape[0],))
+
+
+def _outer(x, z):
+	"""
+	sum of x_k * z_k' over the steps and trajectories
+	"""
+	return np.dot(x.reshape(-1, x.shape[-1]).T, z.reshape(-1, z.shape[-1]))
+
+
+def _affineScan(F, d, negligible=1e-20):
+	"""
+	Solve x_k = F * x_(k-1) + d_k for all the steps at once, with x_(-1) = 0.
+	d: 3D np_array (step, trajectory, state), C-contiguous, it is
+	   overwritten with the solution
+
+	The prefix sums are formed by recursive doubling, after the l-th level
+	x_k holds the sum of the last 2^l terms. F^(2^l) is the same for every
+	step, so a level is a single product of the whole array. For a stable F
+	the powers die out, and the doubling stops once they are negligible.
+	"""
+	T, ntraj, n = d.shape
+	x = d.reshape(T * ntraj, n)
+	product = np.empty_like(x)
+	shift = 1
+	while shift < T and np.max(np.abs(F)) > negligible:
+		s = shift * ntraj
+		np.matmul(x[:-s], F.T, out=product[s:])
+		x[s:] += product[s:]
+		F = np.dot(F, F)
+		shift *= 2
+	return d
+
+
+def _covariancePass(A, H, Q, R, cur_P, T, steady=1e-12):
+	"""
+	Forward recursion of the error covariance shared by all trajectories.
+
+	Return, indexed by the step k = 0, 1, ... (k = 0 is the prior),
+	Ppred: prior error covariance, Pf: current error covariance,
+	K: gain, W: inverse Cholesky factor of S, logdet: log det S.
+	They stop at the step where the covariance reached its steady state,
+	or at T, every later step is the same as the last one.
+	"""
+	n, m = A.shape[0], H.shape[0]
+	Ppred, Pf = [np.zeros((n, n))], [cur_P]
+	K, W, logdet = [np.zeros((n, m))], [np.zeros((m, m))], [0.0]
+	I = np.eye(n)
+
+	for k in range(1, T + 1):
+		Ppred.append(_symmetrize(np.dot(A, np.dot(Pf[-1], A.T)) + Q))
+		S = np.dot(H, np.dot(Ppred[-1], H.T)) + R
+		L = np.linalg.cholesky(S)
+		K.append(choleskySolve(L, np.dot(H, Ppred[-1])).T)
+		W.append(np.linalg.inv(L))
+		logdet.append(2 * np.sum(np.log(np.diag(L))))
+		Pf.append(_symmetrize(np.dot(I - np.dot(K[-1], H), Ppred[-1])))
+
+		if k > 1 and np.max(np.abs(Pf[-1] - Pf[-2])) <= steady * np.max(np.abs(Pf[-1])):
+			break
+
+	return tuple(np.array(arr) for arr in (Ppred, Pf, K, W, logdet))
+
+
+def _forwardPass(A, B, H, cur_x, measureStates, controls, K, W, logdet):
+	"""
+	Forward recursion of the means, batched over the trajectories.
+	Return the current estimates xf (step, trajectory, state) and the
+	total log-likelihood. The Cholesky factors of S from the covariance pass
+	are reused for the log-likelihood of the innovations.
+	Once the gain is steady, the recursion is a scan with a constant matrix.
+	"""
+	T, ntraj, m = measureStates.shape
+	n = A.shape[0]
+	ks = len(K) - 1
+	c = None if controls is None else _dot(controls, B)
+	xf = np.empty((T + 1, ntraj, n))
+	xf[0] = cur_x
+
+	for k in range(1, ks + 1):
+		x = np.dot(xf[k - 1], A.T)
+		if c is not None:
+			x += c[k - 1]
+		xf[k] = x + np.dot(measureStates[k - 1] - np.dot(x, H.T), K[k].T)
+
+	if T > ks:
+		# xf[k] = (I - K * H) * (A * xf[k-1] + c) + K * z
+		G = np.eye(n) - np.dot(K[-1], H)
+		d = _dot(measureStates[ks:], K[-1])
+		if c is not None:
+			d += _dot(c[ks:], G)
+		F = np.dot(G, A)
+		d[0] += np.dot(xf[ks], F.T)
+		xf[ks + 1:] = _affineScan(F, d)
+
+	x = _dot(xf[:-1], A)
+	if c is not None:
+		x += c
+	y = measureStates - _dot(x, H)
+	quad = (np.sum(np.einsum("kij,ktj->kti", W[1:ks + 1], y[:ks]) ** 2)
+		+ np.sum(_dot(y[ks:], W[-1]) ** 2))
+	logdetSum = np.sum(logdet[1:ks + 1]) + (T - ks) * logdet[-1]
+
+	loglik = -0.5 * (quad + ntraj * (logdetSum + T * m * math.log(2 * math.pi)))
+	return xf, loglik
+
+
+def _backwardPass(A, B, xf, controls, Ppred, Pf, steady=1e-12):
+	"""
+	Rauch-Tung-Striebel recursion, batched over the trajectories.
+	Return the smoothed means xs, and the sums over the steps the M-step
+	needs of the smoothed covariances Ps and of the lag-one covariances
+	Pcross[k] = Cov(x_k, x_(k-1)), Ps[0 ... T-1], Ps[1 ... T], Pcross[1 ... T].
+
+	Like the filter, the smoother gain is constant from the steady state
+	on, the means are a reversed scan there, and the covariances, which do
+	not depend on the data, are only iterated until they are steady.
+	"""
+	T = xf.shape[0] - 1
+	ks = len(Pf) - 1
+	c = None if controls is None else _dot(controls, B)
+
+	# smoother gains J[j] = Pf[j] * A' * Ppred[j+1]^-1 for j < ks, Js afterwards
+	J = _transpose(np.linalg.solve(Ppred[1:], np.matmul(A, Pf[:-1])))
+	if T > ks:
+		Js = np.linalg.solve(Ppred[-1], np.dot(A, Pf[-1])).T
+
+	xs = np.empty_like(xf)
+	xs[T] = xf[T]
+	if T > ks:
+		# xs[j] = Js * xs[j+1] + xf[j] - Js * (A * xf[j] + c_j)
+		x = _dot(xf[ks:T], A)
+		if c is not None:
+			x += c[ks:T]
+		e = xf[ks:T] - _dot(x, Js)
+		e[-1] += np.dot(xf[T], Js.T)
+		xs[ks:T] = _affineScan(Js, np.ascontiguousarray(e[::-1]))[::-1]
+
+	for j in range(min(ks, T) - 1, -1, -1):
+		x = np.dot(xf[j], A.T)
+		if c is not None:
+			x += c[j]
+		xs[j] = xf[j] + np.dot(xs[j + 1] - x, J[j].T)
+
+	PsT = Ps = Pf[min(T, ks)]
+	sumPs = Ps.copy()
+	sumCross = np.zeros_like(Ps)
+	j = T - 1
+	while j >= 0:
+		Jj = J[j] if j < ks else Js
+		Psj = _symmetrize(Pf[min(j, ks)] + np.dot(Jj, np.dot(Ps - Ppred[min(j + 1, ks)], Jj.T)))
+		sumCross += np.dot(Ps, Jj.T)
+		sumPs += Psj
+		if j > ks and np.max(np.abs(Psj - Ps)) <= steady * np.max(np.abs(Psj)):
+			# steady state, the same down to step ks
+			sumCross += (j - ks) * np.dot(Psj, Js.T)
+			sumPs += (j - ks) * Psj
+			j = ks
+		Ps = Psj
+		j -= 1
+
+	return xs, sumPs - PsT, sumPs - Ps, sumCross
+
+
+def logLikelihood(measureStates, A, B, H, Q, R, cur_x, cur_P, controls=None):
+	"""
+	Total innovation log-likelihood of the measurements under the model.
+
+	measureStates: 2D np_array (step, measurement) for one trajectory,
+	               3D np_array (trajectory, step, measurement), or a list
+	               of 2D np_array for trajectories of different lengths
+	controls: shaped like measureStates, None means no control
+	"""
+	groups = _asGroups(measureStates, controls)
+	A, B, H, Q, R = (np.asarray(M, dtype=float) for M in (A, B, H, Q, R))
+	passes = _covariancePass(A, H, Q, R, cur_P, max(z.shape[0] for z, u in groups))
+
+	loglik = 0.0
+	for z, u in groups:
+		Ppred, Pf, K, W, logdet = (arr[:z.shape[0] + 1] for arr in passes)
+		loglik += _forwardPass(A, B, H, cur_x, z, u, K, W, logdet)[1]
+	return loglik
+
+
+def emFit(measureStates, A, B, H, Q, R, cur_x, cur_P, controls=None,
+	estimate=("Q", "R"), iterations=100, tol=1e-6, verbose=False):
+	"""
+	Fit the model matrices to recorded measurements with the EM algorithm.
+
+	measureStates: 2D np_array (step, measurement) for one trajectory,
+	               3D np_array (trajectory, step, measurement), or a list
+	               of 2D np_array for trajectories of different lengths,
+	               which are fitted in groups of the same length
+	A, B, H, Q, R: 2D np_array, initial guess of the model matrices
+	cur_x, cur_P: prior estimate of the state before the first measurement
+	controls: shaped like measureStates, None means no control
+	estimate: which of "A", "Q", "R" to fit, the others are kept fixed
+	iterations: maximum number of EM iterations
+	tol: stop when the relative change of the log-likelihood is below tol
+
+	Return the fitted A, Q, R and the log-likelihood of every iteration,
+	evaluated before its M-step.
+	"""
+	groups = _asGroups(measureStates, controls)
+	A, B, H, Q, R = (np.array(M, dtype=float) for M in (A, B, H, Q, R))
+	cur_x = np.asarray(cur_x, dtype=float)
+	cur_P = np.asarray(cur_P, dtype=float)
+	Tmax = max(z.shape[0] for z, u in groups)
+	N = sum(z.shape[0] * z.shape[1] for z, u in groups)
+
+	history = []
+	for it in range(iterations):
+
+		# E-step, the covariances are the same for every group up to its length,
+		# the sufficient statistics are summed over steps and trajectories
+		passes = _covariancePass(A, H, Q, R, cur_P, Tmax)
+		loglik = 0.0
+		E00 = E11 = E10 = ER = 0.0
+		for z, u in groups:
+			ntraj = z.shape[1]
+			Ppred, Pf, K, W, logdet = (arr[:z.shape[0] + 1] for arr in passes)
+			xf, groupLoglik = _forwardPass(A, B, H, cur_x, z, u, K, W, logdet)
+			xs, sumPs0, sumPs1, sumCross = _backwardPass(A, B, xf, u, Ppred, Pf)
+			loglik += groupLoglik
+
+			E00 = E00 + _outer(xs[:-1], xs[:-1]) + ntraj * sumPs0
+			E11 = E11 + _outer(xs[1:], xs[1:]) + ntraj * sumPs1
+			E10 = E10 + _outer(xs[1:], xs[:-1]) + ntraj * sumCross
+			if u is not None:
+				c = _dot(u, B)
+				C1 = _outer(c, xs[1:])
+				E11 = E11 - C1 - C1.T + _outer(c, c)
+				E10 = E10 - _outer(c, xs[:-1])
+			resid = z - _dot(xs[1:], H)
+			ER = ER + _outer(resid, resid) + ntraj * np.dot(H, np.dot(sumPs1, H.T))
+
+		if verbose:
+			print("EM iteration {:d}, log-likelihood {:.6f}".format(it, loglik))
+		converged = bool(history) and abs(loglik - history[-1]) <= tol * abs(history[-1])
+		history.append(loglik)
+		if converged:
+			break
+
+		# M-step
+		if "A" in estimate:
+			A = np.linalg.solve(E00.T, E10.T).T
+		if "Q" in estimate:
+			AE10 = np.dot(A, E10.T)
+			Q = _symmetrize(E11 - AE10 - AE10.T + np.dot(A, np.dot(E00, A.T))) / N
+		if "R" in estimate:
+			R = _symmetrize(ER) / N
+
+	return A, Q, R, history
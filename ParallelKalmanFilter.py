@@ -0,0 +1,461 @@
+"""
+Parallel-in-time Kalman filter and smoother.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+The forward recursion in KalmanFilter.update() is inherently serial.
+Following S. Sarkka and A. F. Garcia-Fernandez, "Temporal Parallelization
+of Bayesian Smoothers", IEEE TAC 66(1), 2021, every step is recast as an
+element of an associative operator. The filtering (and smoothing) results
+are then the prefix "sums" of these elements, which can be computed in
+O(log T) depth instead of T serial steps.
+
+The scan is evaluated on two levels,
+1. inside a chunk, the elements are stored in stacked np_arrays and
+   combined pairwise with vectorized NumPy operations,
+2. the sequence is cut into chunks which are handed to a process pool.
+   Each chunk is first reduced to a single summary element, the summaries
+   are scanned in the main process, and every chunk is then scanned again,
+   starting from the summary of everything that came before it.
+
+The indexing follows KalmanFilter.update(), the k-th measurement is
+applied after the k-th prediction, which uses the k-th control.
+"""
+
+from __future__ import print_function, division
+import multiprocessing
+import numpy as np
+from KalmanFilterBank import choleskyLogLikelihood, packCovariance, _symmetrize, _transpose
+
+# number of steps handled by one task of the process pool
+DEFAULT_CHUNKSIZE = 1 << 16
+
+
+def _take(elems, index):
+	"""
+	slice every array of an element tuple
+	"""
+	return tuple(e[index] for e in elems)
+
+
+def _concat(first, second):
+	"""
+	concatenate two element tuples along the time axis
+	"""
+	return tuple(np.concatenate((a, b)) for a, b in zip(first, second))
+
+
+def _asModel(A, B, H, Q, R, dtype):
+
+	return tuple(np.asarray(M, dtype=dtype) for M in (A, B, H, Q, R))
+
+
+def _filteringElements(model, measureStates, controls, prior=None):
+	"""
+	Build the filtering elements (A, b, C, eta, J) of a block of steps.
+
+	For a step with measurement y and prediction offset c = B * u,
+	S = H * Q * H' + R,    K = Q * H' * S^-1
+	A = (I - K * H) * F,   b = c + K * (y - H * c),  C = (I - K * H) * Q
+	eta = F' * H' * S^-1 * (y - H * c),  J = F' * H' * S^-1 * H * F
+
+	where F is the transition matrix. If prior = (x0, P0) is given, the first
+	element of the block is conditioned on it, which makes A, eta and J vanish.
+	"""
+	F, B, H, Q, R = model
+	T, n = measureStates.shape[0], F.shape[0]
+	I = np.eye(n, dtype=F.dtype)
+
+	if controls is None:
+		c = np.zeros((T, n), dtype=F.dtype)
+	else:
+		c = np.dot(controls, B.T)
+
+	S = np.dot(H, np.dot(Q, H.T)) + R
+	K = np.linalg.solve(S, np.dot(H, Q)).T
+	SinvHF = np.linalg.solve(S, np.dot(H, F))
+	resid = measureStates - np.dot(c, H.T)
+
+	A = np.broadcast_to(np.dot(I - np.dot(K, H), F), (T, n, n)).copy()
+	b = c + np.dot(resid, K.T)
+	C = np.broadcast_to(_symmetrize(np.dot(I - np.dot(K, H), Q)), (T, n, n)).copy()
+	eta = np.dot(resid, SinvHF)
+	J = np.broadcast_to(_symmetrize(np.dot(SinvHF.T, np.dot(H, F))), (T, n, n)).copy()
+
+	if prior is not None:
+		x0, P0 = prior
+		x = np.dot(F, x0) + c[0]
+		P = np.dot(F, np.dot(P0, F.T)) + Q
+		S0 = np.dot(H, np.dot(P, H.T)) + R
+		K0 = np.linalg.solve(S0, np.dot(H, P)).T
+		A[0] = 0.0
+		b[0] = x + np.dot(K0, measureStates[0] - np.dot(H, x))
+		C[0] = _symmetrize(P - np.dot(K0, np.dot(S0, K0.T)))
+		eta[0] = 0.0
+		J[0] = 0.0
+
+	return A, b, C, eta, J
+
+
+def _combineFiltering(ei, ej):
+	"""
+	Associative operator of the filtering elements, ei comes before ej.
+
+	M = A_j * (I + C_i * J_j)^-1
+	A = M * A_i,  b = M * (b_i + C_i * eta_j) + b_j,  C = M * C_i * A_j' + C_j
+	G = A_i' * (I + J_j * C_i)^-1
+	eta = G * (eta_j - J_j * b_i) + eta_i,  J = G * J_j * A_i + J_i
+	"""
+	Ai, bi, Ci, etai, Ji = ei
+	Aj, bj, Cj, etaj, Jj = ej
+
+	D = np.eye(Ai.shape[-1], dtype=Ai.dtype) + np.matmul(Ci, Jj)
+	M = _transpose(np.linalg.solve(_transpose(D), _transpose(Aj)))
+	G = _transpose(np.linalg.solve(D, Ai))
+
+	A = np.matmul(M, Ai)
+	b = np.einsum("kij,kj->ki", M, bi + np.einsum("kij,kj->ki", Ci, etaj)) + bj
+	C = _symmetrize(np.matmul(M, np.matmul(Ci, _transpose(Aj))) + Cj)
+	eta = np.einsum("kij,kj->ki", G, etaj - np.einsum("kij,kj->ki", Jj, bi)) + etai
+	J = _symmetrize(np.matmul(G, np.matmul(Jj, Ai)) + Ji)
+
+	return A, b, C, eta, J
+
+
+def _smoothingElements(model, means, covs, nextControls, last):
+	"""
+	Build the smoothing elements (E, g, L) of a block of filtered estimates.
+
+	E = P * F' * (F * P * F' + Q)^-1
+	g = x - E * (F * x + B * u_next),  L = P - E * F * P
+
+	If the block ends the sequence, its last element is (0, x, P).
+	"""
+	F, B, H, Q, R = model
+	n = F.shape[0]
+
+	if nextControls is None:
+		c = np.zeros_like(means)
+	else:
+		c = np.dot(nextControls, B.T)
+
+	FP = np.matmul(F, covs)
+	Ppred = np.matmul(FP, F.T) + Q
+	E = _transpose(np.linalg.solve(Ppred, FP))
+	g = means - np.einsum("kij,kj->ki", E, np.dot(means, F.T) + c)
+	L = _symmetrize(covs - np.matmul(E, FP))
+
+	if last:
+		E[-1] = np.zeros((n, n))
+		g[-1] = means[-1]
+		L[-1] = covs[-1]
+
+	return E, g, L
+
+
+def _combineSmoothing(ei, ej):
+	"""
+	Associative operator of the smoothing elements, ei comes before ej.
+
+	E = E_i * E_j,  g = E_i * g_j + g_i,  L = E_i * L_j * E_i' + L_i
+	"""
+	Ei, gi, Li = ei
+	Ej, gj, Lj = ej
+
+	E = np.matmul(Ei, Ej)
+	g = np.einsum("kij,kj->ki", Ei, gj) + gi
+	L = _symmetrize(np.matmul(Ei, np.matmul(Lj, _transpose(Ei))) + Li)
+
+	return E, g, L
+
+
+def _scan(elems, combine):
+	"""
+	Inclusive prefix scan of stacked elements.
+	Neighbouring pairs are combined, the half-length sequence is scanned
+	recursively, and the even positions are filled in afterwards.
+	Every level is a single vectorized call of combine().
+	"""
+	T = elems[0].shape[0]
+	if T < 2:
+		return elems
+
+	half = T // 2
+	pairs = combine(_take(elems, slice(0, 2 * half, 2)),
+		_take(elems, slice(1, 2 * half, 2)))
+	# pairs[i] is now the prefix up to position 2 * i + 1
+	pairs = _scan(pairs, combine)
+
+	out = tuple(np.empty_like(e) for e in elems)
+	for o, e, p in zip(out, elems, pairs):
+		o[0] = e[0]
+		o[1:2 * half:2] = p
+
+	nevens = (T - 1) // 2
+	if nevens > 0:
+		evens = combine(_take(pairs, slice(0, nevens)),
+			_take(elems, slice(2, T, 2)))
+		for o, ev in zip(out, evens):
+			o[2::2] = ev
+
+	return out
+
+
+def _reverseScan(elems, combine):
+	"""
+	Inclusive suffix scan of stacked elements.
+	"""
+	swapped = lambda ei, ej: combine(ej, ei)
+	out = _scan(_take(elems, slice(None, None, -1)), swapped)
+	return _take(out, slice(None, None, -1))
+
+
+def _reduce(elems, combine):
+	"""
+	Combine all the elements of a block into one (kept as a block of length 1).
+	"""
+	while elems[0].shape[0] > 1:
+		T = elems[0].shape[0]
+		half = T // 2
+		paired = combine(_take(elems, slice(0, 2 * half, 2)),
+			_take(elems, slice(1, 2 * half, 2)))
+		if T % 2:
+			paired = _concat(paired, _take(elems, slice(T - 1, T)))
+		elems = paired
+	return elems
+
+
+def _logLikelihood(model, prevMeans, prevCovs, measureStates, controls):
+	"""
+	Total innovation log-likelihood of a block of filtered steps, evaluated
+	for all the steps at once from the estimates of the preceding steps.
+	"""
+	F, B, H, Q, R = model
+	x = np.dot(prevMeans, F.T)
+	if controls is not None:
+		x += np.dot(controls, B.T)
+	P = np.matmul(np.matmul(F, prevCovs), F.T) + Q
+	S = np.matmul(np.matmul(H, P), H.T) + R
+	y = measureStates - np.dot(x, H.T)
+	return float(np.sum(choleskyLogLikelihood(np.linalg.cholesky(S), y), dtype=np.float64))
+
+
+def _filterChunk(task):
+	"""
+	Worker of the filtering pass.
+	Either reduce the chunk to its summary element, or scan it starting
+	from the summary (carry) of the preceding chunks. The scan also returns
+	the log-likelihood of the chunk if asked to, else None.
+	"""
+	model, measureStates, controls, prior, carry, summary, packed, likelihood = task
+	elems = _filteringElements(model, measureStates, controls, prior)
+
+	if summary:
+		return _reduce(elems, _combineFiltering)
+
+	if carry is not None:
+		first = _combineFiltering(carry, _take(elems, slice(0, 1)))
+		for e, f in zip(elems, first):
+			e[0] = f[0]
+
+	elems = _scan(elems, _combineFiltering)
+	means, covs = elems[1], elems[2]
+
+	logLikelihood = None
+	if likelihood:
+		# the carry ends with the estimate of the step before the chunk
+		x0, P0 = prior if carry is None else (carry[1][0], carry[2][0])
+		logLikelihood = _logLikelihood(model, np.concatenate((x0[None], means[:-1])),
+			np.concatenate((P0[None], covs[:-1])), measureStates, controls)
+
+	return means, packCovariance(covs) if packed else covs, logLikelihood
+
+
+def _smoothChunk(task):
+	"""
+	Worker of the smoothing pass, the mirror image of _filterChunk().
+	"""
+	model, means, covs, nextControls, last, carry, summary, packed = task
+	elems = _smoothingElements(model, means, covs, nextControls, last)
+
+	if summary:
+		return _reduce(elems, _combineSmoothing)
+
+	if carry is not None:
+		final = _combineSmoothing(_take(elems, slice(-1, None)), carry)
+		for e, f in zip(elems, final):
+			e[-1] = f[0]
+
+	elems = _reverseScan(elems, _combineSmoothing)
+	return elems[1], packCovariance(elems[2]) if packed else elems[2]
+
+
+def _chunkBounds(T, chunksize):
+
+	return [(s, min(s + chunksize, T)) for s in range(0, T, chunksize)]
+
+
+def _openPool(processes, nchunks):
+	"""
+	A process pool is only worth it when there is more than one chunk.
+	"""
+	if processes is None:
+		processes = multiprocessing.cpu_count()
+	processes = min(processes, nchunks)
+	if processes <= 1:
+		return None
+	return multiprocessing.Pool(processes)
+
+
+def _map(pool, func, tasks):
+
+	if pool is None:
+		return [func(task) for task in tasks]
+	return pool.map(func, tasks, chunksize=1)
+
+
+def _filterPass(pool, model, prior, measureStates, controls, bounds, packed=False,
+	likelihood=False):
+
+	def sliceOf(arr, s, e):
+		return None if arr is None else arr[s:e]
+
+	def tasks(carries, summary):
+		return [(model, measureStates[s:e], sliceOf(controls, s, e),
+			prior if s == 0 else None, carry, summary, packed, likelihood)
+			for (s, e), carry in zip(bounds, carries)]
+
+	carries = [None] * len(bounds)
+	if len(bounds) > 1:
+		summaries = _map(pool, _filterChunk, tasks(carries, True))
+		carry = None
+		for i, summary in enumerate(summaries):
+			carries[i] = carry
+			carry = summary if carry is None else _combineFiltering(carry, summary)
+
+	results = _map(pool, _filterChunk, tasks(carries, False))
+	means = np.concatenate([r[0] for r in results])
+	covs = np.concatenate([r[1] for r in results])
+	if likelihood:
+		return means, covs, sum(r[2] for r in results)
+	return means, covs
+
+
+def _smoothPass(pool, model, means, covs, controls, bounds, packed=False):
+
+	T = means.shape[0]
+
+	def nextOf(s, e):
+		if controls is None:
+			return None
+		nxt = controls[s + 1:e + 1]
+		if e == T:
+			# the last step has no successor, pad with a dummy control
+			nxt = np.concatenate((nxt, controls[-1:]))
+		return nxt
+
+	def tasks(carries, summary):
+		return [(model, means[s:e], covs[s:e], nextOf(s, e), e == T,
+			carry, summary, packed)
+			for (s, e), carry in zip(bounds, carries)]
+
+	carries = [None] * len(bounds)
+	if len(bounds) > 1:
+		summaries = _map(pool, _smoothChunk, tasks(carries, True))
+		carry = None
+		for i in reversed(range(len(summaries))):
+			carries[i] = carry
+			carry = summaries[i] if carry is None else _combineSmoothing(summaries[i], carry)
+
+	results = _map(pool, _smoothChunk, tasks(carries, False))
+	smoothMeans = np.concatenate([r[0] for r in results])
+	smoothCovs = np.concatenate([r[1] for r in results])
+	return smoothMeans, smoothCovs
+
+
+def _empty(n, dtype, packed):
+	"""
+	results of a sequence without any step
+	"""
+	if packed:
+		return np.empty((0, n), dtype=dtype), np.empty((0, n * (n + 1) // 2), dtype=dtype)
+	return np.empty((0, n), dtype=dtype), np.empty((0, n, n), dtype=dtype)
+
+
+def _asSequence(measureStates, controls, dtype):
+
+	measureStates = np.asarray(measureStates, dtype=dtype)
+	if controls is not None:
+		controls = np.asarray(controls, dtype=dtype)
+		if controls.shape[0] != measureStates.shape[0]:
+			raise ValueError("need one control per measurement")
+	return measureStates, controls
+
+
+def parallelFilter(A, B, H, Q, R, cur_x, cur_P, measureStates, controls=None,
+	processes=None, chunksize=DEFAULT_CHUNKSIZE, dtype=float, packed=False,
+	likelihood=False):
+	"""
+	Filter a whole sequence with the parallel-in-time scan.
+
+	A, B, H, Q, R: 2D np_array, model matrices as in KalmanFilter
+	cur_x, cur_P: initial estimate of the state and its error covariance
+	measureStates: 2D np_array, one measurement per row
+	controls: 2D np_array, one control per row, None means no control
+	processes: size of the process pool, default is the number of cpus,
+	           1 evaluates everything in the calling process
+	chunksize: number of steps per task
+	dtype: float, or np.float32 to run the scan in reduced precision
+	packed: return the covariance matrices as packed upper triangles,
+	        see KalmanFilterBank.packCovariance()
+	likelihood: also return the total innovation log-likelihood of the
+	            sequence, every task evaluates the one of its chunk
+
+	Return the current estimates of every step, a 2D np_array of states
+	and a 3D (2D if packed) np_array of error covariance matrices. They are
+	the same as the cur_x, cur_P produced by calling KalmanFilter.update()
+	row by row.
+	"""
+	model = _asModel(A, B, H, Q, R, dtype)
+	prior = (np.asarray(cur_x, dtype=dtype), np.asarray(cur_P, dtype=dtype))
+	measureStates, controls = _asSequence(measureStates, controls, dtype)
+	if measureStates.shape[0] == 0:
+		empty = _empty(model[0].shape[0], dtype, packed)
+		return empty + (0.0,) if likelihood else empty
+
+	bounds = _chunkBounds(measureStates.shape[0], chunksize)
+	pool = _openPool(processes, len(bounds))
+	try:
+		return _filterPass(pool, model, prior, measureStates, controls, bounds, packed,
+			likelihood)
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
+
+
+def parallelSmoother(A, B, H, Q, R, cur_x, cur_P, measureStates, controls=None,
+	processes=None, chunksize=DEFAULT_CHUNKSIZE, dtype=float, packed=False):
+	"""
+	Rauch-Tung-Striebel smoothing of a whole sequence with the
+	parallel-in-time scan. The arguments are the same as parallelFilter().
+
+	Return the smoothed estimates of every step, a 2D np_array of states
+	and a 3D (2D if packed) np_array of error covariance matrices.
+	"""
+	model = _asModel(A, B, H, Q, R, dtype)
+	prior = (np.asarray(cur_x, dtype=dtype), np.asarray(cur_P, dtype=dtype))
+	measureStates, controls = _asSequence(measureStates, controls, dtype)
+	if measureStates.shape[0] == 0:
+		return _empty(model[0].shape[0], dtype, packed)
+
+	bounds = _chunkBounds(measureStates.shape[0], chunksize)
+	pool = _openPool(processes, len(bounds))
+	try:
+		means, covs = _filterPass(pool, model, prior, measureStates, controls, bounds)
+		return _smoothPass(pool, model, means, covs, controls, bounds, packed)
+	finally:
+		if pool is not None:
+			pool.close()
+			pool.join()
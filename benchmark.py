@@ -0,0 +1,410 @@
+"""
+Benchmark suite of the filter core, the batch and bank paths and the
+per-frame cost of the GUI.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+Everything runs headless. KalmanFilterSimulatorWindow.draw() is timed on
+a real window if a display (e.g. a virtual one from xvfb-run) is there,
+and on a stubbed canvas otherwise.
+
+	python benchmark.py -o results.json
+	python benchmark.py --compare baseline.json --threshold 0.2
+
+The compare mode exits with status 1 if any result got worse than the
+baseline by more than the threshold. Results the two runs measured under
+different conditions (--quick, --processes, the window of draw()) are
+left out with a warning.
+"""
+
+from __future__ import print_function, division
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+
+from KalmanFilter import KalmanFilter
+from KalmanFilterBank import KalmanFilterBank, unpackCovariance
+from ParallelKalmanFilter import parallelFilter
+from stubwindow import stubWindow
+
+
+def model(n, dt=1 / 30):
+	"""
+	constant velocity model with n // 2 positions observed, like the
+	mouse tracking model for n = 4.
+	"""
+	d = n // 2
+	A = np.eye(n)
+	A[:d, d:2 * d] = dt * np.eye(d)
+	B = np.eye(n)
+	H = np.eye(d, n)
+	Q = 0.01 * np.eye(n)
+	R = 0.1 * np.eye(d)
+	return A, B, H, Q, R
+
+
+def trajectory(n, T, ntracks=None, seed=0):
+	"""
+	random walk measurements, (T, n // 2) or (ntracks, T, n // 2)
+	"""
+	rng = np.random.RandomState(seed)
+	shape = (T, n // 2) if ntracks is None else (ntracks, T, n // 2)
+	return np.cumsum(rng.normal(size=shape), axis=-2)
+
+
+# every measurement is run once to warm up, then at least REPEATS times
+# and for at least MINTIME seconds, and the best run is kept
+REPEATS = 3
+MINTIME = 0.2
+
+
+def _repeat(measure):
+	"""
+	Call measure() after a warm-up call, REPEATS times and for MINTIME
+	seconds at least. Return the list of the measurements.
+	"""
+	measure()
+	runs, elapsed = [], 0.0
+	while len(runs) < REPEATS or elapsed < MINTIME:
+		t = time.perf_counter()
+		runs.append(measure())
+		elapsed += time.perf_counter() - t
+	return runs
+
+
+def _timed(func):
+	"""
+	measure for _repeat(), the time taken by func()
+	"""
+	def measure():
+		t = time.perf_counter()
+		func()
+		return time.perf_counter() - t
+	return measure
+
+
+def _latency(rounds):
+	"""
+	rounds: list of the samples of every run, the best median and p99 are kept
+	"""
+	return {
+		"median": {"value": min(float(np.median(r)) for r in rounds),
+			"unit": "s", "better": "lower", "runs": len(rounds)},
+		"p99": {"value": min(float(np.percentile(r, 99)) for r in rounds),
+			"unit": "s", "better": "lower", "runs": len(rounds)},
+		}
+
+
+def _throughput(value, unit, runs=1):
+
+	return {"value": value, "unit": unit, "better": "higher", "runs": runs}
+
+
+def _bestThroughput(work, unit, func):
+	"""
+	throughput of func(), which does work units, in its fastest run
+	"""
+	times = _repeat(_timed(func))
+	return _throughput(work / min(times), unit, len(times))
+
+
+def benchUpdate(repeat):
+	"""
+	latency of a single KalmanFilter.update() of the mouse tracking model
+	"""
+	A, B, H, Q, R = model(4)
+	H = np.eye(4)
+	R = 0.1 * np.eye(4)
+	kf = KalmanFilter(A, B, H, Q, R, np.zeros(4), np.zeros((4, 4)))
+	measureStates = trajectory(8, repeat)
+	control = np.zeros(4)
+
+	def measure():
+		samples = []
+		for z in measureStates:
+			t = time.perf_counter()
+			kf.update(z, control)
+			samples.append(time.perf_counter() - t)
+		return samples
+	return _latency(_repeat(measure))
+
+
+def benchFilter(sizes, T):
+	"""
+	throughput (steps/s) of KalmanFilter.filter(), serial loop
+	"""
+	results = {}
+	for n in sizes:
+		A, B, H, Q, R = model(n)
+		measureStates = trajectory(n, T)
+		results["n={:d}".format(n)] = _bestThroughput(T, "steps/s",
+			lambda: KalmanFilter(A, B, H, Q, R, np.zeros(n), np.eye(n)).filter(measureStates))
+	return results
+
+
+def benchParallel(sizes, T, processes):
+	"""
+	throughput (steps/s) of the parallel-in-time scan
+	"""
+	results = {}
+	for n in sizes:
+		A, B, H, Q, R = model(n)
+		measureStates = trajectory(n, T)
+		results["n={:d}".format(n)] = _bestThroughput(T, "steps/s",
+			lambda: parallelFilter(A, B, H, Q, R, np.zeros(n), np.eye(n), measureStates,
+				processes=processes))
+	return results
+
+
+# suffix of the result names, dtype and packed covariances of the bank
+PRECISIONS = (
+	("", np.float64, False),
+	(",packed", np.float64, True),
+	(",float32", np.float32, False),
+	(",float32,packed", np.float32, True),
+	)
+
+
+def benchBank(sizes, tracks, nsteps):
+	"""
+	throughput (track updates/s) of KalmanFilterBank.update(), and the
+	memory used per track by the state and by one update, for every
+	precision and covariance storage
+	"""
+	results = {}
+	for n in sizes:
+		A, B, H, Q, R = model(n)
+		for ntracks, (suffix, dtype, packed) in ((t, p) for t in tracks for p in PRECISIONS):
+			key = "n={:d},tracks={:d}{}".format(n, ntracks, suffix)
+			measureStates = trajectory(n, nsteps, ntracks).astype(dtype)
+			bank = KalmanFilterBank(A, B, H, Q, R, np.zeros((ntracks, n)), np.eye(n),
+				dtype=dtype, packed=packed)
+
+			def steps():
+				for z in measureStates.swapaxes(0, 1):
+					bank.update(z)
+			throughput = _bestThroughput(ntracks * nsteps, "tracks/s", steps)
+
+			tracemalloc.start()
+			bank.update(measureStates[:, 0])
+			peak = tracemalloc.get_traced_memory()[1]
+			tracemalloc.stop()
+
+			state = sum(arr.nbytes for arr in (bank.cur_x, bank.cur_P, bank.last_x, bank.last_P))
+			results[key] = {
+				"throughput": throughput,
+				"state_bytes_per_track": {"value": state / ntracks, "unit": "bytes", "better": "lower"},
+				"tracks_per_GB": _throughput(1e9 * ntracks / state, "tracks"),
+				"update_bytes_per_track": {"value": peak / ntracks, "unit": "bytes", "better": "lower"},
+				}
+	return results
+
+
+def _relativeError(value, reference):
+	"""
+	largest deviation from the reference, relative to its largest magnitude
+	"""
+	value = np.asarray(value, dtype=np.float64)
+	return {"value": float(np.max(np.abs(value - reference)) / np.max(np.abs(reference))),
+		"unit": "rel", "better": "lower"}
+
+
+def benchPrecision(sizes, T, ntracks):
+	"""
+	accuracy of the float32 mode and the packed covariances, relative to
+	float64 on the benchmark trajectories. The whole outputs of filter()
+	are kept, so the bank runs a few tracks over T // 10 steps only.
+	"""
+	results = {}
+	for n in sizes:
+		A, B, H, Q, R = model(n)
+		measureStates = trajectory(n, T)
+		means, covs = KalmanFilter(A, B, H, Q, R, np.zeros(n), np.eye(n)).filter(measureStates)
+
+		kf = KalmanFilter(A, B, H, Q, R, np.zeros(n), np.eye(n), dtype=np.float32)
+		means32, covs32 = kf.filter(measureStates)
+		pmeans32, pcovs32 = parallelFilter(A, B, H, Q, R, np.zeros(n), np.eye(n),
+			measureStates, processes=1, dtype=np.float32)
+
+		bankStates = trajectory(n, T // 10, ntracks, seed=1)
+		bank = KalmanFilterBank(A, B, H, Q, R, np.zeros((ntracks, n)), np.eye(n))
+		bmeans, bcovs = bank.filter(bankStates)
+		bank32 = KalmanFilterBank(A, B, H, Q, R, np.zeros((ntracks, n)), np.eye(n),
+			dtype=np.float32, packed=True)
+		bmeans32, bcovs32 = bank32.filter(bankStates)
+
+		results["n={:d}".format(n)] = {
+			"filter_float32": {"x": _relativeError(means32, means), "P": _relativeError(covs32, covs)},
+			"parallel_float32": {"x": _relativeError(pmeans32, means), "P": _relativeError(pcovs32, covs)},
+			"bank_float32_packed": {"x": _relativeError(bmeans32, bmeans),
+				"P": _relativeError(unpackCovariance(bcovs32, n), bcovs)},
+			}
+	return results
+
+
+def _makeWindow(width, height):
+	"""
+	a real window if there is a display, a stubbed one otherwise
+	"""
+	try:
+		from kalman_filter import KalmanFilterSimulatorWindow
+		window = KalmanFilterSimulatorWindow(width, height, "Kalman Filter benchmark")
+		window.stop()
+		window.unbind("<Motion>")
+		return window, "tk"
+	except Exception:
+		return stubWindow(width, height), "stub"
+
+
+def benchDraw(frames):
+	"""
+	latency of KalmanFilterSimulatorWindow.draw(), the cursor moving on a
+	circle, with the mouse trace on and the measurement noise seeded.
+	"""
+	window, backend = _makeWindow(800, 800)
+	window.seed = 0
+	window.setup()
+	window.mousepositionOn = True
+
+	def measure():
+		samples = []
+		for k in range(frames):
+			angle = 2 * np.pi * k / 300
+			window.mousemotion((int(400 + 300 * np.cos(angle)), int(400 + 300 * np.sin(angle))))
+			t = time.perf_counter()
+			window.draw()
+			if backend == "tk":
+				window.update_idletasks()
+			samples.append(time.perf_counter() - t)
+		return samples
+	rounds = _repeat(measure)
+
+	if backend == "tk":
+		window.destroy()
+
+	results = _latency(rounds)
+	results["backend"] = backend
+	return results
+
+
+def run(quick=False, processes=None):
+
+	if quick:
+		sizes, T, tracks, steps, frames, repeat = (4, 8), 2000, (1, 100), 50, 200, 2000
+	else:
+		sizes, T, tracks, steps, frames, repeat = (2, 4, 8, 16), 20000, (1, 100, 10000), 200, 1000, 20000
+
+	return {
+		"meta": {
+			"python": platform.python_version(),
+			"numpy": np.__version__,
+			"platform": platform.platform(),
+			"machine": platform.machine(),
+			"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+			"quick": quick,
+			"processes": processes,
+			},
+		"results": {
+			"update": benchUpdate(repeat),
+			"filter": benchFilter(sizes, T),
+			"parallel": benchParallel(sizes, 4 * T, processes),
+			"bank": benchBank(sizes, tracks, steps),
+			"precision": benchPrecision([n for n in sizes if n <= 8], T, 10),
+			"draw": benchDraw(frames),
+			},
+		}
+
+
+def _flatten(results, prefix=""):
+	"""
+	{"a": {"b": {"value": ...}}} --> {"a/b": {"value": ...}}
+	"""
+	flat = {}
+	for key, val in results.items():
+		name = prefix + key
+		if isinstance(val, dict) and "value" in val:
+			flat[name] = val
+		elif isinstance(val, dict):
+			flat.update(_flatten(val, name + "/"))
+	return flat
+
+
+def _incomparable(baseline, current):
+	"""
+	Return the (prefix, reason) of the results which the two runs measured
+	under different conditions, an empty prefix stands for all of them.
+	"""
+	skipped = []
+	if baseline["meta"].get("quick") != current["meta"].get("quick"):
+		skipped.append(("", "only one of the runs used --quick"))
+	if baseline["meta"].get("processes") != current["meta"].get("processes"):
+		skipped.append(("parallel/", "the runs used different --processes"))
+	backends = [run["results"].get("draw", {}).get("backend") for run in (baseline, current)]
+	if backends[0] != backends[1]:
+		skipped.append(("draw/", "draw() ran on a {} and a {} window".format(*backends)))
+	return skipped
+
+
+def compare(baseline, current, threshold):
+	"""
+	Return the (name, baseline value, current value, relative change) of
+	the results which got worse than the baseline by more than threshold,
+	and the (prefix, reason) of the results left out of the comparison,
+	see _incomparable().
+	"""
+	old, new = _flatten(baseline["results"]), _flatten(current["results"])
+	skipped = _incomparable(baseline, current)
+	regressions = []
+	for name in sorted(set(old) & set(new)):
+		if any(name.startswith(prefix) for prefix, reason in skipped):
+			continue
+		a, b = old[name]["value"], new[name]["value"]
+		if a == 0:
+			continue
+		change = (b - a) / a
+		worse = change > threshold if new[name]["better"] == "lower" else change < -threshold
+		if worse:
+			regressions.append((name, a, b, change))
+	return regressions, skipped
+
+
+def _report(results):
+
+	for name, val in sorted(_flatten(results["results"]).items()):
+		print("{:<48s} {:>14.6g} {}".format(name, val["value"], val["unit"]))
+
+
+if __name__ == "__main__":
+
+	parser = argparse.ArgumentParser(description = "Benchmark the Kalman filter.")
+	parser.add_argument("-o", "--output", help = "save the results to a JSON file")
+	parser.add_argument("--compare", metavar = "BASELINE", help = "compare with a stored JSON baseline")
+	parser.add_argument("--threshold", type = float, default = 0.2,
+		help = "relative change flagged as a regression (default 0.2)")
+	parser.add_argument("--quick", action = "store_true", help = "smaller problem sizes")
+	parser.add_argument("--processes", type = int, help = "process pool size of the parallel filter")
+	args = parser.parse_args()
+
+	results = run(args.quick, args.processes)
+	_report(results)
+
+	if args.output:
+		with open(args.output, "w") as f:
+			json.dump(results, f, indent = 2, sort_keys = True)
+
+	if args.compare:
+		with open(args.compare) as f:
+			baseline = json.load(f)
+		regressions, skipped = compare(baseline, results, args.threshold)
+		for prefix, reason in skipped:
+			print("WARNING not comparing {}: {}".format(prefix + "*" if prefix else "any result", reason))
+		for name, a, b, change in regressions:
+			print("REGRESSION {}: {:.6g} -> {:.6g} ({:+.1%})".format(name, a, b, change))
+		if regressions:
+			sys.exit(1)
+		print("no regressions against {}".format(args.compare))
@@ -13,6 +13,7 @@ from numpy.linalg import inv
 from collections import deque, OrderedDict
 from tkanimation import AnimationWindow, tk
 from KalmanFilter import KalmanFilter
+from metrics import Metrics
 
 
 def _from_rgb(rgb):
@@ -107,6 +108,18 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 	"""
 	The mouse motion tracking window and some GUI input widgets.
 	"""
+
+	# TraceRecorder logging the input of this window, see mousetrace.py
+	tracer = None
+	# seed of the measurement noise, None picks a new one in every setup()
+	seed = None
+	# Metrics shared with the filter, see metrics.py, None disables them
+	metrics = None
+	# draw the metrics on the canvas, toggled with the "m" key
+	metricsOverlayOn = False
+	# StatePublisher sharing the estimates with other processes, see sharedstate.py
+	publisher = None
+
 	def helperWidget(self):
 		"""
 		GUI designer function, 
@@ -233,6 +246,14 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 		self.mouseX, self.mouseY = 0, 0
 		self.premouseX, self.premouseY = 0, 0
 
+		# The measurement noise has its own random generator, 
+		# a recorded seed makes the run repeatable.
+		if self.seed is None:
+			self.noiseSeed = np.random.randint(2**31 - 1)
+		else:
+			self.noiseSeed = self.seed
+		self.rng = np.random.RandomState(self.noiseSeed)
+
 		# delta_t 
 		self.A = np.array([
 			[1, 0, self.frame_time, 0],
@@ -324,6 +345,7 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 		# Instance of the Kalman filter, 
 		self.kfmodel = KalmanFilter(self.A, self.B, self.H, self.Q, self.R, 
 			self.cur_x, self.cur_P)
+		self.kfmodel.metrics = self.metrics
 
 		# Intialize the entries, 
 		# TO THINK: there is a better way? better to put it in a helperWidget() fucntion,
@@ -335,6 +357,9 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 		self.setMatrix("R", self.Rdefault)
 		self.setMatrix("N", self.Ndefault)
 
+		if self.tracer is not None:
+			self.tracer.setup(self, self.noiseSeed)
+
 
 	def draw(self):
 		"""
@@ -343,6 +368,10 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 
 		if not self.running:
 			return
+
+		metrics = self.metrics
+		if metrics is not None:
+			t = metrics.start()
 		
 		# Clean the Canvas first.
 		self.canvas.delete(tk.ALL)
@@ -365,6 +394,12 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 		self.kfmodel.Q = self.Q
 		self.kfmodel.R = self.R
 
+		if self.tracer is not None:
+			self.tracer.tick(self)
+
+		if metrics is not None:
+			t = metrics.lap("entries", t)
+
 		# the core of this code... ....
 		#**************** Kalman Filter *******************#
 		# Hidden State
@@ -372,12 +407,23 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 			(self.mouseX - self.premouseX)/self.frame_time, 
 			(self.mouseY - self.premouseY)/self.frame_time])
 		# Gaussian Noise
-		self.measureNoise = np.random.multivariate_normal(
+		self.measureNoise = self.rng.multivariate_normal(
 			[0, 0, 0, 0], self.N)
 		# Apply measurement, z_k = H_k * x_k + V_k
 		self.measureState = np.dot(self.H, self.curState) + self.measureNoise
+
+		if metrics is not None:
+			t = metrics.lap("noise", t)
 		
 		self.kfmodel.update(self.measureState, self.control)
+
+		if metrics is not None:
+			t = metrics.lap("filter", t)
+
+		if self.publisher is not None:
+			self.publisher.publishFilter(self.kfmodel)
+			if metrics is not None:
+				t = metrics.lap("publish", t)
 		#***************       END       ******************#
 		
 
@@ -412,19 +458,36 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 			drawPoints(self.tPoints)
 		###############################
 
+		if metrics is not None:
+			metrics.end("drawing", t)
+
 		# Not very useful... to show the status of state.
 		#self.showStatus()
+		if self.metricsOverlayOn:
+			self.showMetrics()
 
 		# keep track of the current mouse position as previous mouse position
 		self.premouseX, self.premouseY = self.mouseX, self.mouseY
 
 
 
+	def keypress(self, char, mouseposition):
+		"""
+		"m" toggles the metrics overlay, the metrics are collected from then on
+		"""
+		if char == "m":
+			if self.metrics is None:
+				self.metrics = Metrics()
+				self.kfmodel.metrics = self.metrics
+			self.metricsOverlayOn = not self.metricsOverlayOn
+
 	def mousemotion(self, mouseposition):
 		"""
 		store the mouse position 
 		"""
 		self.mouseX, self.mouseY = mouseposition[0], mouseposition[1]
+		if self.tracer is not None:
+			self.tracer.cursor(self.mouseX, self.mouseY)
 
 	def pauseClick(self):
 		"""
@@ -481,16 +544,19 @@ class KalmanFilterSimulatorWindow(AnimationWindow):
 				self.entries[id][i][j].delete(0, tk.END)
 				self.entries[id][i][j].insert(0, vals[i,j])
 
+	@property
+	def matrices(self):
+		"""
+		the matrices behind the entries, by their id
+		"""
+		return OrderedDict([("A", self.A), ("B", self.B), ("H", self.H),
+			("Q", self.Q), ("R", self.R), ("N", self.N)])
+
 	def modifyMatrix(self, id):
 		"""
 		modify the matrix according to the GUI input.
 		"""
-		switcher = {"A": self.A,
-					"B": self.B,
-					"H": self.H,
-					"Q": self.Q,
-					"R": self.R,
-					"N": self.N}
+		switcher = self.matrices
 
 		for i in range(4):
 			for j in range(4):
@@ -515,9 +581,57 @@ Kalman filter estimation            = ({4:7.0f}, {5:7.0f}, {6:7.2f}, {7:7.2f})\n
 
 		self.canvas.create_text(0, 150, text = statustext, fill = "green4", anchor = tk.NW)
 
+	def showMetrics(self):
+		"""
+		Show the status panel and, below it, the per-stage times 
+		and the innovation statistics collected by the metrics.
+		"""
+		self.showStatus()
+		if self.metrics is None:
+			return
+
+		snapshot = self.metrics.snapshot()
+		lines = ["{0:<8s} calls {1:7d}   mean {2:8.1f} us   p99 < {3:8.1f} us   max {4:8.1f} us".format(
+			name, stage["calls"], stage["mean"] * 1e6, stage["p99"] * 1e6, stage["max"] * 1e6)
+			for name, stage in snapshot["stages"].items()]
+		innovation = snapshot["innovation"]
+		if innovation["count"]:
+			lines.append("innovation mean ({0}), NIS {1:.2f} (expect {2:d})".format(
+				", ".join("{:.2f}".format(v) for v in innovation["mean"]),
+				innovation["nis"], len(innovation["mean"])))
+
+		self.canvas.create_text(0, 210, text = "\n".join(lines), fill = "green4", 
+			anchor = tk.NW, font = ("Courier", 10))
+
 
 
 
 if __name__ == "__main__":
+	import argparse
+	from mousetrace import TraceRecorder, TraceReplayer
+
+	parser = argparse.ArgumentParser(description = "Track the mouse with a Kalman filter.")
+	parser.add_argument("--record", metavar = "TRACE", help = "record the session to a trace file")
+	parser.add_argument("--replay", metavar = "TRACE", help = "replay a recorded trace file")
+	parser.add_argument("--fast", action = "store_true", help = "replay as fast as possible")
+	parser.add_argument("--metrics", action = "store_true", help = "collect and show the runtime metrics")
+	parser.add_argument("--publish", metavar = "NAME", help = "publish the estimates in shared memory")
+	args = parser.parse_args()
+
+	if args.metrics:
+		KalmanFilterSimulatorWindow.metrics = Metrics()
+		KalmanFilterSimulatorWindow.metricsOverlayOn = True
+	if args.publish:
+		from sharedstate import StatePublisher
+		KalmanFilterSimulatorWindow.publisher = StatePublisher(args.publish)
 	window = KalmanFilterSimulatorWindow(800, 800, "Kalman Filter")
-	window.mainloop()
\ No newline at end of file
+	if args.record:
+		recorder = TraceRecorder(args.record, window)
+	if args.replay:
+		replayer = TraceReplayer(args.replay, window)
+		replayer.run(realtime = not args.fast)
+	window.mainloop()
+	if args.record:
+		recorder.close()
+	if args.publish:
+		window.publisher.close()
\ No newline at end of file
@@ -0,0 +1,202 @@
+"""
+Per-stage profiling of the filter and the GUI.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+Instrumented code holds a metrics attribute which is None by default, so
+that the only cost of the disabled instrumentation is a test against None.
+Once a Metrics instance is attached, the code marks the end of each stage,
+
+	t = metrics.start()
+	...                        # stage "predict"
+	t = metrics.lap("predict", t)
+	...                        # stage "gain"
+	metrics.end("gain", t)
+
+and Metrics keeps, for every stage, the call count, the total/min/max time
+and a histogram of the times in power-of-two buckets. If allocations are
+tracked (with tracemalloc, which slows everything down), it also keeps the
+number of calls that allocated memory and the bytes they allocated on top
+of what was alive when the stage started.
+
+Stages may be nested, e.g. the "filter" stage of the window contains the
+stages of KalmanFilter.update(). tracemalloc has a single peak, which
+every start() and lap() resets, so Metrics keeps the stages that are
+still open on a stack and folds the peak into all of them before a reset.
+"""
+
+from __future__ import print_function, division
+import math
+import time
+import tracemalloc
+from collections import OrderedDict
+import numpy as np
+
+# the histogram bucket k holds the times in [2^(k-1), 2^k) * RESOLUTION,
+# bucket 0 everything below RESOLUTION and the last one everything above.
+RESOLUTION = 1e-6
+NBUCKETS = 24
+
+
+class _Stage(object):
+
+	def __init__(self):
+
+		self.calls = 0
+		self.total = 0.0
+		self.min = float("inf")
+		self.max = 0.0
+		self.histogram = [0] * NBUCKETS
+		self.allocCalls = 0
+		self.allocBytes = 0
+
+	def add(self, dt):
+
+		self.calls += 1
+		self.total += dt
+		if dt < self.min:
+			self.min = dt
+		if dt > self.max:
+			self.max = dt
+		self.histogram[min(max(math.frexp(dt / RESOLUTION)[1], 0), NBUCKETS - 1)] += 1
+
+	def percentile(self, q):
+		"""
+		upper edge of the bucket holding the q-th percentile, the last
+		bucket is open, its edge is the largest time
+		"""
+		rank = q / 100 * self.calls
+		count = 0
+		for k, n in enumerate(self.histogram[:-1]):
+			count += n
+			if count >= rank and n > 0:
+				return min(RESOLUTION * 2.0 ** k, self.max)
+		return self.max
+
+	def snapshot(self):
+
+		return {
+			"calls": self.calls,
+			"total": self.total,
+			"mean": self.total / self.calls if self.calls else 0.0,
+			"min": self.min if self.calls else 0.0,
+			"max": self.max,
+			"p50": self.percentile(50),
+			"p99": self.percentile(99),
+			"histogram": list(self.histogram),
+			"allocCalls": self.allocCalls,
+			"allocBytes": self.allocBytes,
+			}
+
+
+class Metrics(object):
+	"""
+	Runtime metrics shared by a KalmanFilter and a KalmanFilterSimulatorWindow.
+
+	allocations: also track memory allocations with tracemalloc
+	"""
+
+	clock = staticmethod(time.perf_counter)
+
+	def __init__(self, allocations=False):
+
+		self.allocations = allocations
+		if allocations and not tracemalloc.is_tracing():
+			tracemalloc.start()
+		# open stages, [start time, memory at the start, peak so far]
+		self.openStages = []
+		self.reset()
+
+	def reset(self):
+
+		self.stages = OrderedDict()
+		# innovation statistics, running mean and sum of squared deviations
+		# (Welford) of the innovation y, and the sum of the normalized
+		# innovation squared y' * S^-1 * y, which averages to dim(y) when
+		# Q and R are right.
+		self.innovations = 0
+		self.innovationMean = None
+		self.innovationM2 = None
+		self.nisTotal = 0.0
+
+	def _foldPeak(self):
+		"""
+		fold the peak of tracemalloc into every open stage, and reset it
+		"""
+		peak = tracemalloc.get_traced_memory()[1]
+		for stage in self.openStages:
+			if peak > stage[2]:
+				stage[2] = peak
+		tracemalloc.reset_peak()
+
+	def start(self):
+
+		if self.allocations:
+			self._foldPeak()
+			stage = [self.clock(), tracemalloc.get_traced_memory()[0], 0]
+			self.openStages.append(stage)
+			return stage
+		return self.clock()
+
+	def end(self, name, start):
+		"""
+		record the stage that began at start, the last one of a sequence
+		"""
+		now = self.clock()
+		stage = self.stages.get(name)
+		if stage is None:
+			stage = self.stages[name] = _Stage()
+
+		if self.allocations:
+			self._foldPeak()
+			began, current, peak = start
+			stage.add(now - began)
+			if peak > current:
+				stage.allocCalls += 1
+				stage.allocBytes += peak - current
+			# close it, and the nested stages which were never ended
+			while self.openStages.pop() is not start:
+				pass
+		else:
+			stage.add(now - start)
+		return now
+
+	def lap(self, name, start):
+		"""
+		record the stage that began at start, and return the start of the next one
+		"""
+		now = self.end(name, start)
+		if self.allocations:
+			return self.start()
+		return now
+
+	def innovation(self, y, nis):
+		"""
+		y: 1D np_array, innovation of the last update
+		nis: float, normalized innovation squared y' * S^-1 * y
+		"""
+		self.innovations += 1
+		if self.innovationMean is None:
+			self.innovationMean = np.zeros(len(y))
+			self.innovationM2 = np.zeros(len(y))
+		delta = y - self.innovationMean
+		self.innovationMean += delta / self.innovations
+		self.innovationM2 += delta * (y - self.innovationMean)
+		self.nisTotal += nis
+
+	def snapshot(self):
+		"""
+		Return the metrics as a dict of plain python values.
+		"""
+		innovation = {"count": self.innovations}
+		if self.innovations:
+			innovation["mean"] = self.innovationMean.tolist()
+			innovation["std"] = np.sqrt(self.innovationM2 / self.innovations).tolist()
+			innovation["nis"] = self.nisTotal / self.innovations
+
+		return {
+			"resolution": RESOLUTION,
+			"stages": OrderedDict((name, stage.snapshot()) for name, stage in self.stages.items()),
+			"innovation": innovation,
+			}
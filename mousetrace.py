@@ -0,0 +1,283 @@
+"""
+Record and replay of the mouse sessions of KalmanFilterSimulatorWindow.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+A trace is a compact, append-only binary file. After a 32 byte header,
+the file is a flat sequence of 24 byte little-endian records,
+
+	t       float64, seconds since the trace was started
+	kind    uint8, CURSOR, FRAME, EDIT or SEED
+	matrix  uint8, code of the edited matrix (EDIT only)
+	row     uint8, row of the edited entry (EDIT only)
+	col     uint8, column of the edited entry (EDIT only)
+	frame   uint32, frame counter
+	payload 8 bytes, int32 x and y (CURSOR), float64 value (EDIT)
+	        or uint64 seed of the measurement noise (SEED)
+
+A SEED record is written whenever the window runs setup(), so it also
+marks a restart. A recorder appending to an existing trace carries on with
+the time and the frame counter of its last record, so that both keep
+increasing over the whole file. Since every record has the same size,
+a trace can be loaded straight into a NumPy structured array, and a trace
+cut short by a crash is still readable up to its last complete record.
+"""
+
+from __future__ import print_function, division
+import os
+import struct
+import time
+import numpy as np
+
+MAGIC = b"KFTRACE\x00"
+VERSION = 1
+
+CURSOR, FRAME, EDIT, SEED = 0, 1, 2, 3
+
+# magic, version, reserved, frame rate, wall clock time of the start
+_header = struct.Struct("<8sHHdd4x")
+_record = struct.Struct("<dBBBBI8s")
+_xy = struct.Struct("<ii")
+_value = struct.Struct("<d")
+_seed = struct.Struct("<Q")
+
+HEADER_SIZE = _header.size
+
+RECORD_DTYPE = np.dtype([
+	("t", "<f8"),
+	("kind", "u1"),
+	("matrix", "u1"),
+	("row", "u1"),
+	("col", "u1"),
+	("frame", "<u4"),
+	("payload", "V8"),
+	])
+
+assert RECORD_DTYPE.itemsize == _record.size
+
+
+class TraceRecorder(object):
+	"""
+	Log the input of a KalmanFilterSimulatorWindow to a trace file.
+	Records are buffered and flushed once per frame.
+	"""
+
+	def __init__(self, path, window):
+
+		self.window = window
+		self.frame = 0
+		self.buffer = []
+		self.starttime = time.perf_counter()
+
+		exists = os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE
+		if exists:
+			with open(path, "rb") as f:
+				magic, version = _header.unpack(f.read(HEADER_SIZE))[:2]
+			if magic != MAGIC or version != VERSION:
+				raise ValueError("{} is not a version {:d} trace".format(path, VERSION))
+			# line up the appended records after those already in the file
+			size = os.path.getsize(path)
+			excess = (size - HEADER_SIZE) % RECORD_DTYPE.itemsize
+			self.file = open(path, "r+b")
+			self.file.truncate(size - excess)
+			if size - excess > HEADER_SIZE:
+				self.file.seek(-_record.size, os.SEEK_END)
+				t, kind, _, _, _, frame, _ = _record.unpack(self.file.read(_record.size))
+				self.starttime -= t
+				self.frame = frame + 1 if kind == FRAME else frame
+			self.file.seek(0, os.SEEK_END)
+		else:
+			self.file = open(path, "wb")
+			self.file.write(_header.pack(MAGIC, VERSION, 0, window.frame_rate, time.time()))
+
+		window.tracer = self
+		self.setup(window, window.noiseSeed)
+		self.flush()
+
+	def _now(self):
+
+		return time.perf_counter() - self.starttime
+
+	def setup(self, window, seed):
+		"""
+		the window (re)started with the given noise seed
+		"""
+		self.buffer.append(_record.pack(self._now(), SEED, 0, 0, 0, self.frame,
+			_seed.pack(seed)))
+		self.matrices = dict((id, window.matrices[id].copy()) for id in window.matrices)
+
+	def cursor(self, x, y):
+
+		self.buffer.append(_record.pack(self._now(), CURSOR, 0, 0, 0, self.frame,
+			_xy.pack(int(x), int(y))))
+
+	def tick(self, window):
+		"""
+		a frame is about to run the filter, log the matrix entries that
+		changed since the last frame and the frame itself.
+		"""
+		t = self._now()
+		for code, id in sorted(window.code2entries.items()):
+			old, new = self.matrices[id], window.matrices[id]
+			for i, j in zip(*np.nonzero(old != new)):
+				self.buffer.append(_record.pack(t, EDIT, code, i, j, self.frame,
+					_value.pack(float(new[i, j]))))
+			old[...] = new
+
+		self.buffer.append(_record.pack(t, FRAME, 0, 0, 0, self.frame, bytes(8)))
+		self.frame += 1
+		self.flush()
+
+	def flush(self):
+
+		self.file.write(b"".join(self.buffer))
+		self.file.flush()
+		del self.buffer[:]
+
+	def close(self):
+
+		if self.window.tracer is self:
+			self.window.tracer = None
+		self.flush()
+		self.file.close()
+
+
+def readTrace(path):
+	"""
+	Load a trace file.
+	Return the header as a dict and the records as a structured np_array
+	of RECORD_DTYPE, memory-mapped from the file.
+	"""
+	with open(path, "rb") as f:
+		magic, version, _, frame_rate, starttime = _header.unpack(f.read(HEADER_SIZE))
+	if magic != MAGIC or version != VERSION:
+		raise ValueError("{} is not a version {:d} trace".format(path, VERSION))
+
+	count = (os.path.getsize(path) - HEADER_SIZE) // RECORD_DTYPE.itemsize
+	if count == 0:
+		records = np.zeros(0, dtype=RECORD_DTYPE)
+	else:
+		records = np.memmap(path, dtype=RECORD_DTYPE, mode="r",
+			offset=HEADER_SIZE, shape=(count,))
+	header = {"version": version, "frame_rate": frame_rate, "starttime": starttime}
+	return header, records
+
+
+def cursorPositions(records):
+	"""
+	Return the times (1D np_array) and positions (2D np_array of int32)
+	of all the cursor events.
+	"""
+	cursor = records[records["kind"] == CURSOR]
+	xy = np.ascontiguousarray(cursor["payload"]).view("<i4").reshape(-1, 2)
+	return np.asarray(cursor["t"]), xy
+
+
+def framePositions(records):
+	"""
+	Return the times (1D np_array) of all the frames and the cursor
+	position (2D np_array) the filter saw in each of them, ready to be
+	filtered as a batch.
+	"""
+	kinds = np.asarray(records["kind"])
+	frames = np.nonzero(kinds == FRAME)[0]
+	cursors = np.nonzero(kinds == CURSOR)[0]
+	setups = np.nonzero(kinds == SEED)[0]
+	xy = cursorPositions(records)[1]
+
+	# the last cursor event before every frame, (0, 0) if there was none
+	# since the last setup, as in KalmanFilterSimulatorWindow.setup().
+	# Record indices of the last cursor event and setup, -1 if none.
+	ncursors = np.searchsorted(cursors, frames)
+	lastCursor = np.append(-1, cursors)[ncursors]
+	lastSetup = np.append(-1, setups)[np.searchsorted(setups, frames)]
+	seen = lastCursor > lastSetup
+	positions = np.zeros((len(frames), 2), dtype=xy.dtype)
+	positions[seen] = xy[ncursors[seen] - 1]
+	return np.asarray(records["t"][frames]), positions
+
+
+def matrixEdits(records):
+	"""
+	Return the EDIT records and their values (1D np_array of float64).
+	"""
+	edits = records[records["kind"] == EDIT]
+	return edits, np.ascontiguousarray(edits["payload"]).view("<f8")
+
+
+def seeds(records):
+	"""
+	Return the SEED records and their seeds (1D np_array of uint64).
+	"""
+	setups = records[records["kind"] == SEED]
+	return setups, np.ascontiguousarray(setups["payload"]).view("<u8")
+
+
+class TraceReplayer(object):
+	"""
+	Drive a KalmanFilterSimulatorWindow from a trace instead of the live
+	mouse and clock. The live animation and mouse binding are switched off,
+	and every record is fed to the same pipeline: SEED reruns setup() with
+	the recorded seed, EDIT writes into the matrix entry, CURSOR calls
+	mousemotion() and FRAME calls draw().
+	"""
+
+	def __init__(self, path, window):
+
+		self.window = window
+		self.header, self.records = readTrace(path)
+		self.index = 0
+		self.finished = len(self.records) == 0
+
+		window.stop()
+		window.unbind("<Motion>")
+
+	def apply(self, record):
+
+		window = self.window
+		kind = record["kind"]
+		payload = record["payload"].tobytes()
+
+		if kind == CURSOR:
+			window.mousemotion(_xy.unpack(payload))
+		elif kind == FRAME:
+			window.draw()
+		elif kind == EDIT:
+			entry = window.entries[window.code2entries[int(record["matrix"])]][record["row"]][record["col"]]
+			entry.delete(0, "end")
+			entry.insert(0, repr(_value.unpack(payload)[0]))
+		elif kind == SEED:
+			window.seed = _seed.unpack(payload)[0]
+			window.setup()
+
+	def run(self, realtime=True):
+		"""
+		realtime: replay the records at their recorded times through the
+		          Tk event loop, otherwise replay them all at once,
+		          as fast as possible, and return when done.
+		"""
+		if realtime:
+			self.starttime = time.perf_counter()
+			self.window.after(0, self._tick)
+			return
+
+		for record in self.records:
+			self.apply(record)
+			if record["kind"] == FRAME:
+				self.window.update_idletasks()
+		self.index = len(self.records)
+		self.finished = True
+
+	def _tick(self):
+
+		elapsed = time.perf_counter() - self.starttime
+		while self.index < len(self.records) and self.records[self.index]["t"] <= elapsed:
+			self.apply(self.records[self.index])
+			self.index += 1
+
+		if self.index < len(self.records):
+			delay = self.records[self.index]["t"] - elapsed
+			self.window.after(max(1, int(delay * 1000)), self._tick)
+		else:
+			self.finished = True
@@ -0,0 +1,247 @@
+"""
+Zero-copy publication of the live estimates to other processes
+through shared memory.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+A StatePublisher owns a shared memory block holding a ring of slots,
+each with a sequence number, a step counter, a timestamp and the cur_x,
+cur_P of every track. There is a single writer and no lock. Every slot
+works as a seqlock. The writer makes the sequence number odd, writes the
+estimates and makes it even again, then it advances the head counter.
+A StateReader maps the same block read-only. It reads the sequence number, copies
+the slot out, and reads the sequence number again. If the two differ,
+the writer was busy with that slot and the reader tries again. Nothing
+is pickled or serialized. Readers copy the slot straight out of the
+writer's arrays.
+
+The sequence numbers are aligned 8 byte words written by single stores,
+which are atomic and kept in order by x86-64. Python has no memory fences,
+and on weakly ordered CPUs (ARM, POWER) a reader could copy a torn slot
+that still passes the check, so both ends refuse to run there.
+"""
+
+from __future__ import print_function, division
+import mmap
+import os
+import platform
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+MAGIC = 0x4b4653484d454d31  # "KFSHMEM1"
+
+# magic, ntracks, state dimension, number of slots, head counter
+_HEADER = np.dtype([
+	("magic", "<u8"),
+	("ntracks", "<i8"),
+	("n", "<i8"),
+	("nslots", "<i8"),
+	("head", "<i8"),
+	])
+
+
+# CPUs which keep the stores, and the loads, of a core in program order
+_ORDERED = ("x86_64", "amd64")
+
+
+def _checkOrdering():
+
+	if platform.machine().lower() not in _ORDERED:
+		raise RuntimeError("the shared memory ring needs the store order of x86-64, "
+			"not available on {}".format(platform.machine()))
+
+
+def slotDtype(ntracks, n):
+	"""
+	one slot of the ring, the estimates of all the tracks at one step
+	"""
+	return np.dtype([
+		("seq", "<i8"),
+		("step", "<i8"),
+		("time", "<f8"),
+		("x", "<f8", (ntracks, n)),
+		("P", "<f8", (ntracks, n, n)),
+		])
+
+
+def _mapReadOnly(name):
+	"""
+	Map a shared memory block read-only. On Linux the block is a file in
+	/dev/shm and is mapped directly, elsewhere SharedMemory attaches to it.
+	"""
+	path = os.path.join("/dev/shm", name.lstrip("/"))
+	if os.path.exists(path):
+		fd = os.open(path, os.O_RDONLY)
+		try:
+			return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+		finally:
+			os.close(fd)
+
+	try:
+		return shared_memory.SharedMemory(name=name, track=False)
+	except TypeError:
+		# before python 3.13 every attached block is tracked, and the
+		# resource tracker of the reader would unlink it when the reader exits.
+		shm = shared_memory.SharedMemory(name=name)
+		from multiprocessing import resource_tracker
+		resource_tracker.unregister(shm._name, "shared_memory")
+		return shm
+
+
+def _views(buf, ntracks, n, nslots):
+
+	header = np.ndarray((), dtype=_HEADER, buffer=buf)
+	slots = np.ndarray((nslots,), dtype=slotDtype(ntracks, n), buffer=buf,
+		offset=_HEADER.itemsize)
+	return header, slots
+
+
+class StatePublisher(object):
+	"""
+	Single writer of the estimates of a KalmanFilter (ntracks = 1) or of a
+	KalmanFilterBank.
+
+	name: name of the shared memory block, None picks a unique one
+	ntracks: number of tracks
+	n: dimension of the state
+	nslots: length of the ring, how far a slow reader may lag behind,
+	        at least 2, so that the newest slot is not the one being written
+	"""
+
+	def __init__(self, name=None, ntracks=1, n=4, nslots=64):
+
+		_checkOrdering()
+		if nslots < 2:
+			raise ValueError("the ring needs at least 2 slots, not {}".format(nslots))
+		size = _HEADER.itemsize + nslots * slotDtype(ntracks, n).itemsize
+		self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+		self.name = self.shm.name
+		self.header, self.slots = _views(self.shm.buf, ntracks, n, nslots)
+		self.ntracks, self.n, self.nslots = ntracks, n, nslots
+
+		self.slots["seq"] = 0
+		self.header["ntracks"] = ntracks
+		self.header["n"] = n
+		self.header["nslots"] = nslots
+		self.header["head"] = 0
+		self.header["magic"] = MAGIC
+		self.count = 0
+
+	def publish(self, x, P, step=None, timestamp=None):
+		"""
+		x: np_array, (ntracks, n), or (n,) for a single track
+		P: np_array, (ntracks, n, n), or (n, n) for a single track
+		step: step counter, the number of publications by default
+		timestamp: time of the estimate, time.time() by default
+		"""
+		slot = self.slots[self.count % self.nslots]
+		seq = 2 * self.count + 1
+
+		# odd while writing, even once the slot is complete
+		slot["seq"] = seq
+		slot["step"] = self.count if step is None else step
+		slot["time"] = time.time() if timestamp is None else timestamp
+		slot["x"] = np.reshape(x, (self.ntracks, self.n))
+		slot["P"] = np.reshape(P, (self.ntracks, self.n, self.n))
+		slot["seq"] = seq + 1
+
+		self.count += 1
+		self.header["head"] = self.count
+
+	def publishFilter(self, kfmodel, step=None):
+		"""
+		publish cur_x, cur_P of a KalmanFilter or a KalmanFilterBank,
+		packed covariances are published unpacked
+		"""
+		if getattr(kfmodel, "packed", False):
+			self.publish(kfmodel.cur_x, kfmodel.covariances(), step)
+		else:
+			self.publish(kfmodel.cur_x, kfmodel.cur_P, step)
+
+	def close(self, unlink=True):
+
+		del self.header, self.slots
+		self.shm.close()
+		if unlink:
+			self.shm.unlink()
+
+
+class StateReader(object):
+	"""
+	Read-only view of the ring written by a StatePublisher in another process.
+	"""
+
+	def __init__(self, name):
+
+		_checkOrdering()
+		self.shm = _mapReadOnly(name)
+		buf = self.shm.buf if isinstance(self.shm, shared_memory.SharedMemory) else self.shm
+
+		header = np.ndarray((), dtype=_HEADER, buffer=buf)
+		if header["magic"] != MAGIC:
+			raise ValueError("{} holds no published estimates".format(name))
+		self.ntracks, self.n, self.nslots = (int(header["ntracks"]),
+			int(header["n"]), int(header["nslots"]))
+		del header
+
+		self.header, self.slots = _views(buf, self.ntracks, self.n, self.nslots)
+		self.header.flags.writeable = False
+		self.slots.flags.writeable = False
+
+	@property
+	def head(self):
+		"""
+		number of estimates published so far
+		"""
+		return int(self.header["head"])
+
+	def read(self, count):
+		"""
+		Return the count-th published slot (0 based) as a np.void record with
+		seq, step, time, x, P, or None if it was overwritten in the meantime.
+		"""
+		slot = self.slots[count % self.nslots]
+		seq = 2 * count + 2
+		if slot["seq"] != seq:
+			return None
+		record = slot.copy()
+		if slot["seq"] != seq or record["seq"] != seq:
+			return None
+		return record
+
+	def latest(self):
+		"""
+		Return the newest complete slot, or None if nothing was published yet.
+		"""
+		while True:
+			head = self.head
+			if head == 0:
+				return None
+			record = self.read(head - 1)
+			if record is not None:
+				return record
+
+	def poll(self, after, timeout=None, interval=1e-4):
+		"""
+		Wait until there are estimates newer than the count after.
+		Return those which are still in the ring, in order, and the new
+		count to pass to the next poll(). Return no records if the timeout
+		(seconds) expires first. interval is the sleep between two checks,
+		0 spins on a whole core.
+		"""
+		deadline = None if timeout is None else time.perf_counter() + timeout
+		while self.head <= after:
+			if deadline is not None and time.perf_counter() > deadline:
+				return [], after
+			time.sleep(interval)
+
+		head = self.head
+		records = [self.read(count) for count in range(max(after, head - self.nslots), head)]
+		return [r for r in records if r is not None], head
+
+	def close(self):
+
+		del self.header, self.slots
+		self.shm.close()
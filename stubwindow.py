@@ -0,0 +1,72 @@
+"""
+Stand-ins for the Tk widgets of KalmanFilterSimulatorWindow, to run
+draw() without a display, in the benchmark and the tests.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+"""
+
+from __future__ import print_function, division
+
+
+class StubEntry(object):
+
+	def __init__(self):
+		self.text = ""
+
+	def delete(self, first, last=None):
+		self.text = ""
+
+	def insert(self, index, value):
+		self.text = str(value)
+
+	def get(self):
+		return self.text
+
+
+class StubCanvas(dict):
+	"""
+	counts the items instead of drawing them
+	"""
+
+	def __init__(self, width, height):
+		dict.__init__(self, width=str(width), height=str(height))
+		self.items = 0
+
+	def delete(self, *args):
+		self.items = 0
+
+	def _create(self, *args, **kwargs):
+		self.items += 1
+		return self.items
+
+	create_oval = create_line = create_text = _create
+
+
+class StubVar(object):
+
+	def __init__(self, value):
+		self.value = value
+
+	def get(self):
+		return self.value
+
+
+def stubWindow(width, height):
+	"""
+	a KalmanFilterSimulatorWindow without Tk, only what draw() touches
+	"""
+	from kalman_filter import KalmanFilterSimulatorWindow
+
+	window = KalmanFilterSimulatorWindow.__new__(KalmanFilterSimulatorWindow)
+	window.canvas = StubCanvas(width, height)
+	window.set_frame_rate(30)
+	window.code2entries = {0: "A", 1: "B", 2: "H", 3: "Q", 4: "R", 5: "N"}
+	window.entries = dict((id, [[StubEntry() for j in range(4)] for i in range(4)])
+		for id in window.code2entries.values())
+	window.showMouseTraceButtonOn = StubVar(True)
+	window.lifetime = 4
+	window.unbind = lambda *args: None
+	window.update_idletasks = lambda: None
+	window.setup()
+	return window
@@ -0,0 +1,82 @@
+"""
+Tests of KalmanFilterBank against one sequential KalmanFilter per track.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import pytest
+
+from KalmanFilter import KalmanFilter
+from KalmanFilterBank import KalmanFilterBank, packCovariance, unpackCovariance
+from benchmark import model, trajectory
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_bank_matches_filter(packed):
+
+	A, B, H, Q, R = model(4)
+	ntracks, T = 5, 100
+	measureStates = trajectory(4, T, ntracks)
+	controls = 0.01 * np.random.RandomState(1).normal(size=(ntracks, T, 4))
+	cur_x = np.random.RandomState(2).normal(size=(ntracks, 4))
+
+	bank = KalmanFilterBank(A, B, H, Q, R, cur_x, np.eye(4), packed=packed)
+	means, covs = bank.filter(measureStates, controls)
+	if packed:
+		covs = unpackCovariance(covs, 4)
+
+	for k in range(ntracks):
+		kf = KalmanFilter(A, B, H, Q, R, cur_x[k], np.eye(4))
+		kmeans, kcovs = kf.filter(measureStates[k], controls[k])
+		np.testing.assert_allclose(means[k], kmeans, rtol=0, atol=1e-9)
+		np.testing.assert_allclose(covs[k], kcovs, rtol=0, atol=1e-9)
+		assert bank.logLikelihood[k] == pytest.approx(kf.logLikelihood, rel=1e-10)
+
+
+def test_log_likelihood_is_gaussian_density():
+
+	A, B, H, Q, R = model(4)
+	measureStates = trajectory(4, 50, 2)
+	bank = KalmanFilterBank(A, B, H, Q, R, np.zeros((2, 4)), np.eye(4))
+	for k in range(50):
+		x = np.dot(bank.cur_x, A.T)
+		P = np.matmul(A, np.matmul(bank.cur_P, A.T)) + Q
+		S = np.matmul(H, np.matmul(P, H.T)) + R
+		y = measureStates[:, k] - np.dot(x, H.T)
+		expected = [-0.5 * (np.dot(y[i], np.linalg.solve(S[i], y[i]))
+			+ np.linalg.slogdet(2 * np.pi * S[i])[1]) for i in range(2)]
+		bank.update(measureStates[:, k])
+		np.testing.assert_allclose(bank.logLikelihood, expected, rtol=1e-10)
+
+
+@pytest.mark.parametrize("n", [2, 4, 5])
+def test_pack_unpack_round_trip(n):
+
+	rng = np.random.RandomState(n)
+	M = rng.normal(size=(3, 7, n, n))
+	P = M + np.swapaxes(M, -1, -2)
+	packed = packCovariance(P)
+	assert packed.shape == (3, 7, n * (n + 1) // 2)
+	np.testing.assert_array_equal(unpackCovariance(packed, n), P)
+	np.testing.assert_array_equal(packed[0, 0], P[0, 0][np.triu_indices(n)])
+
+
+def test_bank_float32():
+
+	A, B, H, Q, R = model(4)
+	measureStates = trajectory(4, 200, 3)
+	bank = KalmanFilterBank(A, B, H, Q, R, np.zeros((3, 4)), np.eye(4))
+	bank32 = KalmanFilterBank(A, B, H, Q, R, np.zeros((3, 4)), np.eye(4),
+		dtype=np.float32, packed=True)
+	means, covs = bank.filter(measureStates)
+	means32, covs32 = bank32.filter(measureStates)
+
+	assert means32.dtype == np.float32
+	assert covs32.shape == (3, 200, 10)
+	np.testing.assert_allclose(means32, means, rtol=0, atol=1e-5 * np.max(np.abs(means)))
+	np.testing.assert_allclose(unpackCovariance(covs32, 4), covs, rtol=0, atol=1e-6)
@@ -0,0 +1,76 @@
+"""
+Tests of the EM fit and its log-likelihood against the sequential
+KalmanFilter.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import pytest
+
+from KalmanFilter import KalmanFilter
+from KalmanFilterEM import emFit, logLikelihood
+from benchmark import model, trajectory
+
+
+def test_em_log_likelihood_never_decreases():
+
+	A, B, H, Q, R = model(4)
+	measureStates = trajectory(4, 2000, 3)
+	controls = 0.01 * np.random.RandomState(1).normal(size=(3, 2000, 4))
+	A, Q, R, history = emFit(measureStates, A, B, H, 0.05 * Q, 10 * R, np.zeros(4),
+		np.eye(4), controls=controls, estimate=("A", "Q", "R"), iterations=30, tol=0)
+
+	assert len(history) == 30
+	assert np.all(np.diff(history) >= -1e-8 * np.abs(history[1:]))
+	assert history[-1] > history[0]
+	np.testing.assert_allclose(Q, Q.T)
+	assert np.all(np.linalg.eigvalsh(R) > 0)
+
+
+def test_em_log_likelihood_matches_filter():
+
+	A, B, H, Q, R = model(4)
+	rng = np.random.RandomState(0)
+	measureStates = trajectory(4, 3000)
+	controls = 0.01 * rng.normal(size=(3000, 4))
+	cur_x = rng.normal(size=4)
+
+	kf = KalmanFilter(A, B, H, Q, R, cur_x, np.eye(4))
+	kf.filter(measureStates, controls)
+	assert logLikelihood(measureStates, A, B, H, Q, R, cur_x, np.eye(4),
+		controls=controls) == pytest.approx(kf.logLikelihood, rel=1e-10)
+
+
+def test_em_ragged_trajectories():
+
+	A, B, H, Q, R = model(4)
+	rng = np.random.RandomState(3)
+	measureStates = [trajectory(4, T, seed=k) for k, T in enumerate((500, 800, 500, 1200))]
+	controls = [0.01 * rng.normal(size=(len(z), 4)) for z in measureStates]
+
+	total = 0.0
+	for z, u in zip(measureStates, controls):
+		kf = KalmanFilter(A, B, H, Q, R, np.zeros(4), np.eye(4))
+		kf.filter(z, u)
+		total += kf.logLikelihood
+	assert logLikelihood(measureStates, A, B, H, Q, R, np.zeros(4), np.eye(4),
+		controls=controls) == pytest.approx(total, rel=1e-10)
+
+	fitted = emFit(measureStates, A, B, H, 0.05 * Q, 10 * R, np.zeros(4), np.eye(4),
+		controls=controls, estimate=("A", "Q", "R"), iterations=20, tol=0)
+	history = fitted[-1]
+	assert np.all(np.diff(history) >= -1e-8 * np.abs(history[1:]))
+	assert history[-1] > history[0]
+
+	# equal lengths give the same fit as the stacked array
+	same = emFit(measureStates[::2], A, B, H, 0.05 * Q, 10 * R, np.zeros(4), np.eye(4),
+		controls=controls[::2], iterations=5, tol=0)
+	stacked = emFit(np.array(measureStates[::2]), A, B, H, 0.05 * Q, 10 * R, np.zeros(4),
+		np.eye(4), controls=np.array(controls[::2]), iterations=5, tol=0)
+	for M, N in zip(same, stacked):
+		np.testing.assert_allclose(M, N, rtol=1e-12)
@@ -0,0 +1,130 @@
+"""
+Tests of the parallel-in-time filter and smoother against the sequential
+KalmanFilter and the Rauch-Tung-Striebel smoother.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+import numpy as np
+import pytest
+
+from KalmanFilter import KalmanFilter
+from KalmanFilterBank import unpackCovariance
+from ParallelKalmanFilter import parallelFilter, parallelSmoother
+from benchmark import model, trajectory
+
+
+def _problem(n=4, T=300, controlled=False, seed=0):
+
+	A, B, H, Q, R = model(n)
+	rng = np.random.RandomState(seed)
+	measureStates = trajectory(n, T, seed=seed)
+	controls = 0.01 * rng.normal(size=(T, n)) if controlled else None
+	return (A, B, H, Q, R, rng.normal(size=n), np.eye(n)), measureStates, controls
+
+
+def _serial(args, measureStates, controls):
+
+	return KalmanFilter(*args).filter(measureStates, controls)
+
+
+def _rts(args, means, covs, controls):
+	"""
+	Rauch-Tung-Striebel smoother, one step after the other
+	"""
+	A, B = args[0], args[1]
+	Q = args[3]
+	xs, Ps = means.copy(), covs.copy()
+	for k in range(len(means) - 2, -1, -1):
+		x = np.dot(A, means[k])
+		if controls is not None:
+			x += np.dot(B, controls[k + 1])
+		P = np.dot(A, np.dot(covs[k], A.T)) + Q
+		J = np.dot(covs[k], np.dot(A.T, np.linalg.inv(P)))
+		xs[k] = means[k] + np.dot(J, xs[k + 1] - x)
+		Ps[k] = covs[k] + np.dot(J, np.dot(Ps[k + 1] - P, J.T))
+	return xs, Ps
+
+
+@pytest.mark.parametrize("chunksize", [1, 7, 64, 300])
+@pytest.mark.parametrize("controlled", [False, True])
+def test_parallel_filter_matches_serial(chunksize, controlled):
+
+	args, measureStates, controls = _problem(controlled=controlled)
+	means, covs = _serial(args, measureStates, controls)
+
+	pmeans, pcovs = parallelFilter(*args, measureStates=measureStates,
+		controls=controls, processes=1, chunksize=chunksize)
+	np.testing.assert_allclose(pmeans, means, rtol=0, atol=1e-9)
+	np.testing.assert_allclose(pcovs, covs, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("chunksize", [1, 7, 64, 300])
+@pytest.mark.parametrize("controlled", [False, True])
+def test_parallel_smoother_matches_rts(chunksize, controlled):
+
+	args, measureStates, controls = _problem(controlled=controlled)
+	means, covs = _serial(args, measureStates, controls)
+	xs, Ps = _rts(args, means, covs, controls)
+
+	smeans, scovs = parallelSmoother(*args, measureStates=measureStates,
+		controls=controls, processes=1, chunksize=chunksize)
+	np.testing.assert_allclose(smeans, xs, rtol=0, atol=1e-9)
+	np.testing.assert_allclose(scovs, Ps, rtol=0, atol=1e-9)
+
+
+@pytest.mark.parametrize("chunksize", [1, 64, 300])
+def test_parallel_log_likelihood_matches_serial(chunksize):
+
+	args, measureStates, controls = _problem(controlled=True)
+	kf = KalmanFilter(*args)
+	kf.filter(measureStates, controls)
+
+	means, covs, loglik = parallelFilter(*args, measureStates=measureStates,
+		controls=controls, processes=1, chunksize=chunksize, likelihood=True)
+	assert loglik == pytest.approx(kf.logLikelihood, rel=1e-10)
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_parallel_filter_process_pool(packed):
+
+	args, measureStates, controls = _problem(T=1000, controlled=True)
+	serial = KalmanFilter(*args)
+	means, covs = serial.filter(measureStates, controls)
+
+	kf = KalmanFilter(*args)
+	pmeans, pcovs = kf.filter(measureStates, controls, parallel=True, processes=2,
+		packed=packed)
+	if packed:
+		pcovs = unpackCovariance(pcovs, 4)
+	np.testing.assert_allclose(pmeans, means, rtol=0, atol=1e-9)
+	np.testing.assert_allclose(pcovs, covs, rtol=0, atol=1e-9)
+	np.testing.assert_allclose(kf.cur_x, means[-1], rtol=0, atol=1e-9)
+	np.testing.assert_allclose(kf.last_P, covs[-2], rtol=0, atol=1e-9)
+	assert kf.logLikelihood == pytest.approx(serial.logLikelihood, rel=1e-10)
+
+
+@pytest.mark.parametrize("packed", [False, True])
+def test_parallel_empty_sequence(packed):
+
+	args, measureStates, controls = _problem()
+	means, covs = parallelFilter(*args, measureStates=np.empty((0, 2)), packed=packed)
+	assert means.shape == (0, 4)
+	assert covs.shape == ((0, 10) if packed else (0, 4, 4))
+	means, covs = parallelSmoother(*args, measureStates=np.empty((0, 2)), packed=packed)
+	assert means.shape == (0, 4)
+
+
+def test_parallel_filter_float32():
+
+	args, measureStates, controls = _problem(T=1000)
+	means, covs = _serial(args, measureStates, controls)
+	pmeans, pcovs = parallelFilter(*args, measureStates=measureStates, processes=1,
+		chunksize=64, dtype=np.float32)
+	assert pmeans.dtype == np.float32 and pcovs.dtype == np.float32
+	np.testing.assert_allclose(pmeans, means, rtol=0, atol=1e-5 * np.max(np.abs(means)))
+	np.testing.assert_allclose(pcovs, covs, rtol=0, atol=1e-5)
@@ -0,0 +1,63 @@
+"""
+Tests of the compare mode of the benchmark suite.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+
+from benchmark import compare
+
+
+def _run(values, quick=False, processes=None, backend="stub"):
+	"""
+	a benchmark run with the given {name: (value, better)} results
+	"""
+	results = {"draw": {"backend": backend}}
+	for name, (value, better) in values.items():
+		group, key = name.split("/")
+		results.setdefault(group, {})[key] = {"value": value, "unit": "", "better": better}
+	return {"meta": {"quick": quick, "processes": processes}, "results": results}
+
+
+def test_compare_direction():
+
+	baseline = _run({"filter/n=4": (1000.0, "higher"), "update/median": (1.0, "lower"),
+		"update/p99": (2.0, "lower"), "bank/n=8": (500.0, "higher")})
+	current = _run({"filter/n=4": (700.0, "higher"), "update/median": (1.5, "lower"),
+		"update/p99": (1.0, "lower"), "bank/n=8": (900.0, "higher")})
+
+	regressions, skipped = compare(baseline, current, 0.2)
+	assert skipped == []
+	assert [(name, a, b) for name, a, b, change in regressions] == [
+		("filter/n=4", 1000.0, 700.0), ("update/median", 1.0, 1.5)]
+	assert regressions[0][3] == -0.3 and regressions[1][3] == 0.5
+
+	assert compare(baseline, current, 0.6) == ([], [])
+
+
+def test_compare_zero_baseline_and_missing_results():
+
+	baseline = _run({"bank/a": (0.0, "lower"), "bank/b": (1.0, "lower")})
+	current = _run({"bank/a": (5.0, "lower"), "bank/c": (9.0, "lower")})
+	assert compare(baseline, current, 0.2) == ([], [])
+
+
+def test_compare_skips_by_prefix():
+
+	values = {"parallel/n=4": (1000.0, "higher"), "draw/median": (1.0, "lower"),
+		"filter/n=4": (1000.0, "higher")}
+	worse = {"parallel/n=4": (100.0, "higher"), "draw/median": (10.0, "lower"),
+		"filter/n=4": (100.0, "higher")}
+
+	regressions, skipped = compare(_run(values, processes=2),
+		_run(worse, processes=4, backend="tk"), 0.2)
+	assert [name for name, a, b, change in regressions] == ["filter/n=4"]
+	assert [prefix for prefix, reason in skipped] == ["parallel/", "draw/"]
+
+	regressions, skipped = compare(_run(values), _run(worse, quick=True), 0.2)
+	assert regressions == []
+	assert [prefix for prefix, reason in skipped] == [""]
@@ -0,0 +1,134 @@
+"""
+Tests of the per-stage metrics, alone and attached to a stubbed window.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+import tracemalloc
+import numpy as np
+import pytest
+
+import metrics
+from metrics import Metrics
+from stubwindow import stubWindow
+
+
+class _Clock(object):
+	"""
+	a clock which advances by the given steps
+	"""
+
+	def __init__(self, *steps):
+		self.now = 0.0
+		self.steps = list(steps)
+
+	def __call__(self):
+		if self.steps:
+			self.now += self.steps.pop(0)
+		return self.now
+
+
+def test_stage_counts_and_histogram():
+
+	m = Metrics()
+	# 0.5 us, 1.5 us, 3 us, 3 us and 100 s long stages
+	m.clock = _Clock(0, 0.5e-6, 0, 1.5e-6, 0, 3e-6, 0, 3e-6, 0, 100.0)
+	for k in range(5):
+		m.end("stage", m.start())
+	stage = m.snapshot()["stages"]["stage"]
+
+	assert stage["calls"] == 5
+	assert stage["total"] == pytest.approx(100.0 + 8e-6)
+	assert stage["min"] == pytest.approx(0.5e-6)
+	assert stage["max"] == pytest.approx(100.0)
+	histogram = [0] * metrics.NBUCKETS
+	histogram[0], histogram[1], histogram[2], histogram[-1] = 1, 1, 2, 1
+	assert stage["histogram"] == histogram
+
+	# upper edges of the buckets, and the largest time for the last one
+	assert stage["p50"] == pytest.approx(4e-6)
+	assert stage["p99"] == pytest.approx(100.0)
+	assert m.stages["stage"].percentile(20) == pytest.approx(1e-6)
+	assert m.stages["stage"].percentile(40) == pytest.approx(2e-6)
+
+
+def test_lap_chains_the_stages():
+
+	m = Metrics()
+	m.clock = _Clock(0, 1e-3, 2e-3)
+	t = m.start()
+	t = m.lap("first", t)
+	m.end("second", t)
+	stages = m.snapshot()["stages"]
+
+	assert list(stages) == ["first", "second"]
+	assert stages["first"]["total"] == pytest.approx(1e-3)
+	assert stages["second"]["total"] == pytest.approx(2e-3)
+
+
+def test_innovation_statistics():
+
+	rng = np.random.RandomState(0)
+	ys = rng.normal(loc=(1.0, -2.0), scale=(0.5, 3.0), size=(1000, 2))
+	nis = rng.chisquare(2, size=1000)
+	m = Metrics()
+	for y, e in zip(ys, nis):
+		m.innovation(y, e)
+	innovation = m.snapshot()["innovation"]
+
+	assert innovation["count"] == 1000
+	np.testing.assert_allclose(innovation["mean"], ys.mean(axis=0), rtol=1e-12)
+	np.testing.assert_allclose(innovation["std"], ys.std(axis=0), rtol=1e-12)
+	assert innovation["nis"] == pytest.approx(nis.mean())
+	assert Metrics().snapshot()["innovation"] == {"count": 0}
+
+
+def test_nested_stages_with_allocations():
+
+	tracing = tracemalloc.is_tracing()
+	try:
+		m = Metrics(allocations=True)
+		outer = m.start()
+		inner = m.start()
+		buf = np.ones(1 << 16)
+		m.lap("inner", inner)
+		# a nested stage left open is closed with the enclosing one
+		m.start()
+		m.end("outer", outer)
+		del buf
+	finally:
+		if not tracing:
+			tracemalloc.stop()
+	stages = m.snapshot()["stages"]
+
+	assert m.openStages == []
+	assert stages["inner"]["allocCalls"] == 1
+	assert stages["inner"]["allocBytes"] >= 8 << 16
+	assert stages["outer"]["allocBytes"] >= stages["inner"]["allocBytes"]
+
+
+def test_window_draw_stages():
+
+	tracing = tracemalloc.is_tracing()
+	try:
+		window = stubWindow(400, 300)
+		window.metrics = Metrics(allocations=True)
+		window.kfmodel.metrics = window.metrics
+		for k in range(20):
+			window.mousemotion((200 + k, 150 - k))
+			window.draw()
+	finally:
+		if not tracing:
+			tracemalloc.stop()
+	snapshot = window.metrics.snapshot()
+
+	assert window.metrics.openStages == []
+	for name in ("entries", "noise", "filter", "drawing", "predict", "gain", "correct"):
+		assert snapshot["stages"][name]["calls"] == 20
+	# the filter stage of the window encloses the stages of update()
+	assert snapshot["stages"]["filter"]["allocCalls"] == 20
+	assert snapshot["innovation"]["count"] == 20
@@ -0,0 +1,77 @@
+"""
+Tests of the trace recording and replay, on a stubbed window.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+import numpy as np
+
+import mousetrace
+from stubwindow import stubWindow
+
+
+def _session(path, seed):
+	"""
+	Record a session of a stubbed window, with cursor motion, a restart
+	and a matrix edit. Return the estimates of every frame.
+	"""
+	window = stubWindow(400, 300)
+	window.seed = seed
+	window.setup()
+	recorder = mousetrace.TraceRecorder(path, window)
+
+	estimates = []
+	for k in range(60):
+		window.mousemotion((200 + k, 150 - 2 * k))
+		if k == 20:
+			window.entries["R"][0][0].delete(0, "end")
+			window.entries["R"][0][0].insert(0, "2.5")
+		if k == 40:
+			window.setup()
+		window.draw()
+		estimates.append(window.kfmodel.cur_x.copy())
+	recorder.close()
+	return estimates
+
+
+def _replay(path):
+
+	window = stubWindow(400, 300)
+	estimates = []
+	draw = window.draw
+
+	def recordedDraw():
+		draw()
+		estimates.append(window.kfmodel.cur_x.copy())
+
+	window.draw = recordedDraw
+	mousetrace.TraceReplayer(path, window).run(realtime=False)
+	return estimates
+
+
+def test_trace_replay_is_deterministic(tmp_path):
+
+	path = str(tmp_path / "session.kft")
+	recorded = _session(path, seed=7)
+	replayed = _replay(path)
+
+	assert len(replayed) == len(recorded)
+	np.testing.assert_array_equal(np.array(replayed), np.array(recorded))
+	np.testing.assert_array_equal(np.array(_replay(path)), np.array(recorded))
+
+
+def test_trace_append_keeps_time_and_frames_increasing(tmp_path):
+
+	path = str(tmp_path / "session.kft")
+	first = _session(path, seed=7)
+	second = _session(path, seed=8)
+	header, records = mousetrace.readTrace(path)
+
+	assert np.all(np.diff(records["t"]) >= 0)
+	assert np.all(np.diff(records["frame"].astype(np.int64)) >= 0)
+	assert len(mousetrace.framePositions(records)[0]) == len(first) + len(second)
+	np.testing.assert_array_equal(np.array(_replay(path)), np.array(first + second))
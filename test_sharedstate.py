@@ -0,0 +1,157 @@
+"""
+Tests of the shared memory ring of the live estimates.
+
+Copyright (c) 2019 by Yanfei Tang (yanfeit89@163.com).
+Open source software license: MIT
+
+	python -m pytest -q
+"""
+
+from __future__ import print_function, division
+import multiprocessing
+import platform
+import time
+import numpy as np
+import pytest
+
+from KalmanFilterBank import KalmanFilterBank
+from metrics import Metrics
+from sharedstate import StatePublisher, StateReader
+from benchmark import model, trajectory
+from stubwindow import stubWindow
+
+pytestmark = pytest.mark.skipif(platform.machine().lower() not in ("x86_64", "amd64"),
+	reason="the shared memory ring runs on x86-64 only")
+
+
+@pytest.fixture
+def ring():
+
+	publisher = StatePublisher(ntracks=2, n=3, nslots=4)
+	reader = StateReader(publisher.name)
+	yield publisher, reader
+	reader.close()
+	publisher.close()
+
+
+def _publish(publisher, count):
+
+	for k in range(count):
+		publisher.publish(np.full((2, 3), k), np.full((2, 3, 3), -k), timestamp=k)
+
+
+def test_nslots_at_least_two():
+
+	with pytest.raises(ValueError):
+		StatePublisher(nslots=1)
+
+
+def test_read_and_overwritten_slots(ring):
+
+	publisher, reader = ring
+	assert reader.head == 0
+	assert reader.latest() is None
+	assert reader.read(0) is None
+
+	_publish(publisher, 6)
+	assert reader.head == 6
+	# slots 0 and 1 were overwritten by 4 and 5
+	assert reader.read(0) is None
+	assert reader.read(1) is None
+	record = reader.read(3)
+	assert record["step"] == 3 and record["time"] == 3
+	np.testing.assert_array_equal(record["x"], np.full((2, 3), 3))
+	np.testing.assert_array_equal(record["P"], np.full((2, 3, 3), -3))
+	assert reader.read(6) is None
+
+	latest = reader.latest()
+	assert latest["step"] == 5
+	np.testing.assert_array_equal(latest["x"], np.full((2, 3), 5))
+
+
+def test_poll(ring):
+
+	publisher, reader = ring
+	t = time.perf_counter()
+	assert reader.poll(0, timeout=0.05) == ([], 0)
+	assert time.perf_counter() - t >= 0.05
+
+	_publish(publisher, 2)
+	records, count = reader.poll(0, timeout=1)
+	assert count == 2
+	assert [r["step"] for r in records] == [0, 1]
+
+	# a reader lagging behind by more than the ring gets the last nslots
+	_publish(publisher, 7)
+	records, count = reader.poll(count, timeout=1)
+	assert count == 9
+	assert [r["step"] for r in records] == [5, 6, 7, 8]
+
+
+def test_publish_packed_float32_bank():
+
+	A, B, H, Q, R = model(4)
+	bank = KalmanFilterBank(A, B, H, Q, R, np.zeros((3, 4)), np.eye(4),
+		dtype=np.float32, packed=True)
+	bank.filter(trajectory(4, 20, 3))
+
+	publisher = StatePublisher(ntracks=3, n=4)
+	reader = StateReader(publisher.name)
+	try:
+		publisher.publishFilter(bank, step=20)
+		record = reader.latest()
+	finally:
+		reader.close()
+		publisher.close()
+
+	assert record["step"] == 20
+	np.testing.assert_array_equal(record["x"], bank.cur_x)
+	np.testing.assert_array_equal(record["P"], bank.covariances())
+
+
+def test_window_publishes_in_its_own_stage():
+
+	window = stubWindow(400, 300)
+	window.metrics = window.kfmodel.metrics = Metrics()
+	window.publisher = StatePublisher()
+	reader = StateReader(window.publisher.name)
+	try:
+		for k in range(5):
+			window.mousemotion((200 + k, 150))
+			window.draw()
+		head, record = reader.head, reader.latest()
+	finally:
+		reader.close()
+		window.publisher.close()
+
+	assert head == 5
+	np.testing.assert_array_equal(record["x"][0], window.kfmodel.cur_x)
+	stages = window.metrics.snapshot()["stages"]
+	assert list(stages)[-3:] == ["filter", "publish", "drawing"]
+	assert stages["publish"]["calls"] == 5
+
+
+def _readLatest(name, queue):
+
+	reader = StateReader(name)
+	records, count = reader.poll(0, timeout=10)
+	queue.put((count, records[-1]["x"].copy() if records else None))
+	reader.close()
+
+
+def test_reader_in_another_process():
+
+	publisher = StatePublisher(ntracks=1, n=2)
+	try:
+		queue = multiprocessing.Queue()
+		process = multiprocessing.Process(target=_readLatest, args=(publisher.name, queue))
+		process.start()
+		publisher.publish(np.array([1.0, 2.0]), np.eye(2))
+		count, x = queue.get(timeout=10)
+		process.join(10)
+	finally:
+		publisher.close()
+
+	assert process.exitcode == 0
+	assert count >= 1
+	np.testing.assert_array_equal(x, [[1.0, 2.0]])